@@ -0,0 +1,44 @@
+__metaclass__ = type
+
+from ansible.errors import AnsibleActionFail
+from ansible.plugins.action import ActionBase
+
+from ..module_utils.client import get_upcloud_client
+from ..module_utils.loadbalancer import (
+    LOADBALANCER_BACKEND_MEMBER_MUTUALLY_EXCLUSIVE,
+    loadbalancer_backend_member_argument_spec,
+    update_backend_members,
+)
+
+try:
+    from upcloud_api.errors import UpCloudAPIError
+except ImportError:
+    UpCloudAPIError = RuntimeError
+
+
+class ActionModule(ActionBase):
+    """Update load balancer backend members in the controller process instead of executing the module.
+
+    The API client is shared by every task and member handled in the same process, and O(members)
+    allows updating a whole C(serial) batch with a single read of the backend.
+    """
+
+    TRANSFERS_FILES = False
+    _requires_connection = False
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        dummy, args = self.validate_argument_spec(
+            argument_spec=loadbalancer_backend_member_argument_spec(),
+            mutually_exclusive=LOADBALANCER_BACKEND_MEMBER_MUTUALLY_EXCLUSIVE,
+        )
+
+        try:
+            client = get_upcloud_client()
+            result.update(update_backend_members(args, check_mode=self._task.check_mode, client=client))
+        except (RuntimeError, UpCloudAPIError, ValueError) as e:
+            raise AnsibleActionFail(str(e))
+
+        return result
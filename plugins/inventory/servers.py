@@ -14,6 +14,7 @@ DOCUMENTATION = r'''
         - Uses a YAML configuration file that ends with upcloud.(yml|yaml).
     extends_documentation_fragment:
         - constructed
+        - inventory_cache
     options:
         plugin:
             description: The name of the UpCloud Ansible inventory plugin
@@ -91,6 +92,195 @@ DOCUMENTATION = r'''
             default: ""
             type: str
             required: false
+        shard_count:
+            description:
+                - Split the servers into this many shards, for example to run the same playbook from several controllers.
+                  Only the servers of shard O(shard_index) are added to the inventory and their details fetched.
+                - Servers are assigned to shards by rendezvous hashing of the server UUID, so adding or removing servers
+                  does not move other servers between shards, and changing the number of shards moves only the servers
+                  that the new or removed shards get or give up.
+            default: 1
+            type: int
+            required: false
+            version_added: "0.11.0"
+        shard_index:
+            description:
+                - Index of the shard to populate the inventory with, from V(0) to O(shard_count) - 1.
+            default: 0
+            type: int
+            required: false
+            version_added: "0.11.0"
+        facts:
+            description:
+                - Add facts that are available from the API as host variables with the names used by fact gathering, so that
+                  plays that only need these can disable C(gather_facts).
+                - Adds C(ansible_processor_vcpus), C(ansible_processor_nproc), C(ansible_memtotal_mb),
+                  C(ansible_all_ipv4_addresses) and C(ansible_all_ipv6_addresses). Operating system facts are not available.
+            default: false
+            type: bool
+            required: false
+            version_added: "0.11.0"
+        include_loadbalancers:
+            description:
+                - Add the load balancer backend memberships of the hosts to C(upcloud_lb_memberships) variable and the hosts to
+                  C(upcloud_lb_<load balancer name>) and C(upcloud_lb_<load balancer name>_<backend name>) groups.
+                - The load balancers of the account are listed once, and their backend members are matched to the servers by
+                  IP address.
+                - Each membership contains C(loadbalancer) (UUID), C(loadbalancer_name), C(backend), C(member), C(ip_address),
+                  C(port), C(weight) and C(enabled).
+            default: false
+            type: bool
+            required: false
+            version_added: "0.11.0"
+        batch_size:
+            description:
+                - Split the hosts into C(upcloud_batch_<n>) groups of at most this many hosts for rolling updates, and set the
+                  number of the batch of each host, starting from V(1), to C(upcloud_batch) variable.
+                - A batch contains at most O(batch_max_fraction) of the hosts of any zone, server group or load balancer
+                  backend, but always at least one, so a batch can be smaller than O(batch_size). Backends are known only
+                  when O(include_loadbalancers) is enabled.
+                - V(0) disables the batch groups.
+            default: 0
+            type: int
+            required: false
+            version_added: "0.11.0"
+        batch_max_fraction:
+            description:
+                - Maximum fraction of the hosts of a zone, server group or load balancer backend in a single batch when
+                  O(batch_size) is set.
+            default: 0.25
+            type: float
+            required: false
+            version_added: "0.11.0"
+        concurrency:
+            description:
+                - Maximum number of API requests in flight at the same time while populating the inventory.
+                - The network and server group lookups are sent together with the server listing, and details of servers
+                  are fetched as soon as the servers have passed the zone, state, tag, label and shard filters.
+                - V(1) sends the requests one at a time.
+            default: 8
+            type: int
+            required: false
+            version_added: "0.11.0"
+        timeout:
+            description:
+                - Maximum time in seconds for fetching the servers from the API. Requests are given at most the time that is
+                  left, and details of servers that could not be fetched in time are handled according to O(degraded_servers).
+                - V(0) means no limit.
+            default: 0
+            type: int
+            required: false
+            version_added: "0.11.0"
+        request_timeout:
+            description:
+                - Timeout in seconds for a single API request. Defaults to the timeout of the API client.
+            type: int
+            required: false
+            version_added: "0.11.0"
+        degraded_servers:
+            description:
+                - What to do with servers whose details could not be fetched because of an API error or O(timeout).
+                - V(add) adds the server with the variables available from the server listing to the V(upcloud_degraded) group.
+                  C(ansible_host) is set only if O(connect_with) includes V(hostname).
+                - V(skip) leaves the server out of the inventory.
+                - The failed servers are reported in a single warning at the end of the run.
+            default: add
+            type: str
+            choices: [add, skip]
+            required: false
+            version_added: "0.11.0"
+        group_by:
+            description:
+                - Add hosts to groups by these server attributes without templating. Faster than the equivalent O(keyed_groups)
+                  with large inventories.
+                - Groups are named as with O(keyed_groups) using prefix C(upcloud_<attribute>), for example
+                  C(upcloud_zone_de-fra1), C(upcloud_tag_prod), C(upcloud_label_role=web) and C(upcloud_label_key_role).
+                  Invalid characters in group names are handled according to the C(TRANSFORM_INVALID_GROUP_CHARS) setting.
+            default: []
+            type: list
+            elements: str
+            choices: [zone, state, plan, tags, labels, label_keys, server_group]
+            required: false
+            version_added: "0.11.0"
+        construct_processes:
+            description:
+                - Number of worker processes for evaluating O(compose), O(groups) and O(keyed_groups) of the hosts. Speeds up
+                  very large inventories with many templated options on controllers with several CPU cores.
+                - The resulting inventory is the same as when evaluating the hosts in the inventory process.
+                - V(0) evaluates the hosts in the inventory process. Requires the C(fork) multiprocessing start method.
+            default: 0
+            type: int
+            required: false
+            version_added: "0.11.0"
+        probe_connection:
+            description:
+                - Choose C(ansible_host) by testing which of the addresses allowed by O(connect_with) accept TCP connections to
+                  O(probe_port). The first reachable address in the order of O(connect_with) is used.
+                - All addresses of all running servers are probed concurrently. If none of the addresses of a server is
+                  reachable, the first one is used as without probing.
+                - The chosen addresses are cached on disk for O(probe_cache_ttl) seconds.
+            default: false
+            type: bool
+            required: false
+            version_added: "0.11.0"
+        probe_port:
+            description: TCP port to probe when O(probe_connection) is enabled.
+            default: 22
+            type: int
+            required: false
+            version_added: "0.11.0"
+        probe_timeout:
+            description: Seconds to wait for a single connection when O(probe_connection) is enabled.
+            default: 2
+            type: float
+            required: false
+            version_added: "0.11.0"
+        probe_concurrency:
+            description: Maximum number of connections tested at the same time when O(probe_connection) is enabled.
+            default: 100
+            type: int
+            required: false
+            version_added: "0.11.0"
+        probe_cache_ttl:
+            description:
+                - Seconds to cache the address chosen for each server by O(probe_connection). The cache is invalidated when
+                  the addresses of the server change. V(0) disables the cache.
+            default: 600
+            type: int
+            required: false
+            version_added: "0.11.0"
+        change_groups:
+            description:
+                - Compare the hosts with the previous run of the inventory source and add them to C(upcloud_added),
+                  C(upcloud_changed) and C(upcloud_unchanged) groups, for example to run a playbook only against new and
+                  modified servers with C(--limit upcloud_added:upcloud_changed).
+                - A host is changed when its state, zone, plan, labels, tags or addresses have changed. On the first run all
+                  hosts are added. Hosts in C(upcloud_degraded) group are not compared.
+                - The hosts of the previous run are stored on disk for each inventory source.
+            default: false
+            type: bool
+            required: false
+            version_added: "0.11.0"
+        update_change_baseline:
+            description:
+                - Store the hosts of this run as the baseline that the next run is compared to when O(change_groups) is
+                  enabled. Disable for runs that should not consume the changes, such as C(ansible-inventory --graph).
+            default: true
+            type: bool
+            required: false
+            env:
+                - name: UPCLOUD_UPDATE_CHANGE_BASELINE
+            version_added: "0.11.0"
+        trace_file:
+            description:
+                - Write a timeline of the API requests and inventory phases of the run to this file in Chrome trace event
+                  format. The file can be opened in trace viewers such as U(https://ui.perfetto.dev).
+                - Tracing is disabled when not set.
+            type: path
+            required: false
+            env:
+                - name: UPCLOUD_TRACE_FILE
+            version_added: "0.11.0"
 '''
 
 EXAMPLES = r"""
@@ -117,6 +307,36 @@ labels:
   - foo
 server_group: group name or uuid
 
+# Second of three controllers, each running the playbook against a third of the servers
+plugin: upcloud.cloud.servers
+shard_count: 3
+shard_index: 1
+
+# Add load balancer backend memberships of the hosts, e.g. for taking hosts out of load balancing during rolling updates
+plugin: upcloud.cloud.servers
+include_loadbalancers: true
+
+# Rolling update batches of up to 20 hosts with at most a tenth of any zone or load balancer backend in one batch.
+# Run the play for one batch at a time, e.g. with `--limit upcloud_batch_1`.
+plugin: upcloud.cloud.servers
+include_loadbalancers: true
+batch_size: 20
+batch_max_fraction: 0.1
+
+# Connect over the public IPv4 address and fall back to the utility network when the public address is not reachable
+plugin: upcloud.cloud.servers
+connect_with:
+  - public_ipv4
+  - utility_ipv4
+probe_connection: true
+
+# Cache servers for 10 minutes in the jsonfile cache
+plugin: upcloud.cloud.servers
+cache: true
+cache_plugin: ansible.builtin.jsonfile
+cache_connection: ~/.ansible/upcloud/inventory
+cache_timeout: 600
+
 # Group by a zone with prefix e.g. "upcloud_zone_us-nyc1"
 # and state with prefix e.g. "server_state_running"
 plugin: upcloud.cloud.servers
@@ -125,20 +345,71 @@ keyed_groups:
     prefix: upcloud_zone
   - key: state
     prefix: server_state
+
+# Group by zone, plan, label keys and tags without templating,
+# e.g. "upcloud_zone_us-nyc1", "upcloud_plan_1xCPU-2GB", "upcloud_label_key_role" and "upcloud_tag_prod"
+plugin: upcloud.cloud.servers
+group_by:
+  - zone
+  - plan
+  - label_keys
+  - tags
 """
 
+import hashlib
+import json
+import multiprocessing
 import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import List
-from ansible.errors import AnsibleError
+from ansible.errors import AnsibleError, AnsibleParserError
+from ansible.inventory.data import InventoryData
 from ansible.module_utils.common.text.converters import to_native
-from ansible.plugins.inventory import BaseInventoryPlugin, Constructable
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
 from ansible.utils.display import Display
 
-from ..module_utils.client import initialize_upcloud_client
+from ..module_utils import trace
+from ..module_utils.cache import FileCache
+from ..module_utils.client import client_cache_key, get_upcloud_client
+from ..module_utils.loadbalancer import LoadBalancerTopology, member_ip_address
+from ..module_utils.servers import run_concurrently
 
 display = Display()
 
+# Server listings and details fetched by earlier inventory sources of this process, keyed by credentials and API root
+_SHARED_SERVERS = {}
+_SHARED_SERVERS_MAX_AGE = 300
+
+# Version of the data stored in the inventory cache, cached data with other versions is ignored
+_SNAPSHOT_VERSION = 2
+
+# Server listing and details fields stored in the inventory cache
+_LISTING_FIELDS = (
+    "uuid", "hostname", "title", "state", "zone", "plan", "labels", "tags", "server_group", "core_number", "memory_amount",
+)
+_DETAIL_FIELDS = ("uuid", "firewall", "tags", "metadata", "server_group", "networking")
+
+_LOADBALANCER_PAGE_SIZE = 100
+
+# Host variables compared by change_groups
+_CHANGE_FIELDS = ("state", "zone", "plan", "labels", "tags", "public_ip", "utility_ip", "ansible_host")
+
+# Group name prefix and function returning the group keys from host variables for each group_by choice
+_GROUP_BY = {
+    "zone": ("upcloud_zone", lambda hostvars: [hostvars["zone"]]),
+    "state": ("upcloud_state", lambda hostvars: [hostvars["state"]]),
+    "plan": ("upcloud_plan", lambda hostvars: [hostvars["plan"]]),
+    "tags": ("upcloud_tag", lambda hostvars: hostvars["tags"]),
+    "labels": ("upcloud_label", lambda hostvars: hostvars["labels"]),
+    "label_keys": ("upcloud_label_key", lambda hostvars: [label.split("=", 1)[0] for label in hostvars["labels"]]),
+    "server_group": ("upcloud_server_group", lambda hostvars: [hostvars["server_group"]]),
+}
+
 try:
+    import requests
     from upcloud_api.errors import UpCloudAPIError
     UC_AVAILABLE = True
 except ImportError:
@@ -150,9 +421,98 @@ class NoAvailableAddressException(Exception):
     pass
 
 
-class InventoryModule(BaseInventoryPlugin, Constructable):
+class _ConstructError:
+    """Error raised in a construct worker process, returned instead of raised to keep it picklable"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class _RecordingInventory:
+    """Inventory that records the changes made to it"""
+
+    RECORDED = ("add_group", "add_host", "add_child", "set_variable")
+
+    def __init__(self, inventory):
+        self._inventory = inventory
+        self.changes = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._inventory, name)
+        if name not in self.RECORDED:
+            return attr
+
+        def _record(*args, **kwargs):
+            self.changes.append((name, args, kwargs))
+            return attr(*args, **kwargs)
+
+        return _record
+
+
+# Plugin whose hosts are constructed in the forked worker processes
+_CONSTRUCTING_PLUGIN = None
+
+
+def _record_hosts(hosts):
+    """Add hosts to a scratch inventory with the plugin of the parent process, return the recorded changes"""
+    plugin = _CONSTRUCTING_PLUGIN
+    scratch = InventoryData()
+    scratch.add_group("upcloud")
+    plugin.inventory = _RecordingInventory(scratch)
+    # Groups created for earlier chunks handled by this worker are not in the scratch inventory
+    plugin._native_groups = {}
+
+    try:
+        for host in hosts:
+            plugin._add_host(*host)
+    except Exception as e:
+        return _ConstructError(to_native(e))
+
+    return plugin.inventory.changes
+
+
+class ServerDetailsUnavailableException(Exception):
+    """Raised when server details could not be fetched or the inventory timeout has been reached"""
+    pass
+
+
+class _SharedServers:
+    def __init__(self, servers):
+        self.created = time.monotonic()
+        self.servers = servers
+        self.details = {}
+
+
+class _CachedResource:
+    """Server or network restored from the inventory cache"""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
     name = 'upcloud'
 
+    _shared_key = None
+
+    # Snapshot used instead of the API, and snapshot whose server details are reused for unchanged servers
+    _cached_snapshot = None
+    _previous_snapshot = None
+
+    # Time by which fetching the servers should be finished, None for no limit
+    _deadline = None
+
+    # Executor for concurrent API requests and the futures of requests started ahead of use
+    _executor = None
+    _prefetched = {}
+    _prefetched_details = {}
+
+    # Load balancer backend members indexed by IP address when include_loadbalancers is enabled
+    _loadbalancers = None
+
+    # (UUID, addresses) of the hosts to probe when probe_connection is enabled, keyed by hostname
+    _connection_candidates = {}
+
     def _initialize_upcloud_client(self):
         self.username_env = self.get_option("username_env")
         self.username = self.templar.template(self.get_option("username"), fail_on_undefined=False) or os.getenv(
@@ -167,7 +527,18 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
             self.token_env
         )
 
-        self.client = initialize_upcloud_client(self.username, self.password, self.token)
+        self.client = get_upcloud_client(self.username, self.password, self.token)
+        self._shared_key = client_cache_key(self.username, self.password, self.token)
+
+    def _get_shared_servers(self):
+        if self._shared_key is None:
+            return None
+
+        shared = _SHARED_SERVERS.get(self._shared_key)
+        if shared is None or time.monotonic() - shared.created > _SHARED_SERVERS_MAX_AGE:
+            return None
+
+        return shared
 
     def _fetch_servers(self):
         return self.client.get_servers()
@@ -178,13 +549,146 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
     def _fetch_network_details(self, uuid):
         return self.client.get_network(uuid)
 
+    def _fetch_loadbalancers(self):
+        loadbalancers = []
+        while True:
+            params = {"limit": _LOADBALANCER_PAGE_SIZE, "offset": len(loadbalancers)}
+            page = self.client.api.get_request("/load-balancer", params=params)
+            loadbalancers.extend(page)
+            if len(page) < _LOADBALANCER_PAGE_SIZE:
+                return loadbalancers
+
     def _fetch_server_groups(self):
         return self.client.api.get_request("/server-group/")
 
     def _get_servers(self):
+        shared = self._get_shared_servers()
+        if shared is not None:
+            display.vv("Using server listing fetched by an earlier inventory source")
+            self.servers = list(shared.servers)
+            return
+
         self.servers = self._fetch_servers()
+        if self._shared_key is not None:
+            _SHARED_SERVERS[self._shared_key] = _SharedServers(list(self.servers))
+
+    def _request_timeout(self):
+        """Return context in which API requests are limited by request_timeout and the time left until the deadline"""
+        timeout = self.get_option("request_timeout") or None
+        if self._deadline is not None:
+            remaining = self._deadline - time.monotonic()
+            if remaining <= 0:
+                raise ServerDetailsUnavailableException("inventory timeout reached")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        if timeout is None:
+            return nullcontext()
+
+        return self.client.api.timeout_override(timeout)
+
+    def _fetch_server_details_within_timeout(self, uuid):
+        try:
+            with self._request_timeout():
+                return self._fetch_server_details(uuid)
+        except UpCloudAPIError as e:
+            raise ServerDetailsUnavailableException(str(e))
+        except requests.exceptions.RequestException as e:
+            raise ServerDetailsUnavailableException(f"request failed: {e}")
+
+    def _call_within_timeout(self, func, *args):
+        with self._request_timeout():
+            return func(*args)
+
+    def _prefetch(self, name, func, *args):
+        """Start func in the background if concurrent requests are enabled, the result is read with _get_prefetched"""
+        if self._executor is not None:
+            self._prefetched[name] = self._executor.submit(self._call_within_timeout, func, *args)
+
+    def _get_prefetched(self, name, func, *args):
+        future = self._prefetched.pop(name, None)
+        if future is not None:
+            return future.result()
+
+        return self._call_within_timeout(func, *args)
+
+    def _prefetch_server_details(self):
+        """Start fetching details of the servers that can not be reused from the inventory cache"""
+        if self._executor is None:
+            return
+
+        for server in self.servers:
+            if not self._is_reusable(server) and server.uuid not in self._prefetched_details:
+                self._prefetched_details[server.uuid] = self._executor.submit(self._load_server_details, server)
+
+    def _is_reusable(self, server):
+        reusable = self._reusable_details.get(server.uuid)
+        return reusable is not None and reusable["fingerprint"] == _fingerprint(server)
+
+    def _load_server_details(self, server):
+        shared = self._get_shared_servers()
+        if shared is None:
+            return self._fetch_server_details_within_timeout(server.uuid)
+
+        if server.uuid not in shared.details:
+            shared.details[server.uuid] = self._fetch_server_details_within_timeout(server.uuid)
+        return shared.details[server.uuid]
+
+    def _get_server_details(self, server):
+        details = None
+
+        if self._is_reusable(server):
+            details = _CachedResource(self._reusable_details[server.uuid]["details"])
+        elif self._cached_snapshot is not None:
+            raise ServerDetailsUnavailableException("details are not in the inventory cache")
+        elif server.uuid in self._prefetched_details:
+            details = self._prefetched_details[server.uuid].result()
+        else:
+            details = self._load_server_details(server)
+
+        self._server_details[server.uuid] = details
+        return details
+
+    def _load_snapshot(self, snapshot):
+        self.servers = [_CachedResource(server) for server in snapshot["servers"]]
+        if snapshot.get("network"):
+            self.network = _CachedResource({"uuid": snapshot["network"]})
+        if snapshot.get("loadbalancers") is not None:
+            self._loadbalancers = LoadBalancerTopology(snapshot["loadbalancers"])
+
+    def _make_snapshot(self):
+        network = getattr(self, "network", None) if self.get_option("network") else None
+
+        now = time.time()
+        previous = self._cached_snapshot or self._previous_snapshot
+
+        return {
+            "version": _SNAPSHOT_VERSION,
+            "fetched_at": now,
+            # Time when details of all servers were last fetched
+            "full_fetched_at": previous.get("full_fetched_at", now) if previous else now,
+            "network": network.uuid if network else None,
+            "loadbalancers": _trim_loadbalancers(self._loadbalancers.loadbalancers) if self._loadbalancers is not None else None,
+            "servers": [_resource_to_dict(server, _LISTING_FIELDS) for server in self.servers],
+            "details": {
+                server.uuid: {
+                    "fingerprint": _fingerprint(server),
+                    "details": _resource_to_dict(self._server_details[server.uuid], _DETAIL_FIELDS),
+                }
+                for server in self.servers if server.uuid in self._server_details
+            },
+        }
+
+    def _read_snapshot(self, cache_key):
+        """Return the snapshot stored in the inventory cache, raises KeyError if there is no usable snapshot"""
+        snapshot = self._cache[cache_key]
+        if not isinstance(snapshot, dict) or snapshot.get("version") != _SNAPSHOT_VERSION:
+            raise KeyError(cache_key)
+
+        return snapshot
 
     def _filter_servers(self):
+        self._filter_shard()
+
         if self.get_option("zones"):
             display.vv("Choosing servers by zone")
             tmp = []
@@ -230,10 +734,13 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
 
             self.servers = tmp
 
+        # Details of the servers that passed the filters above can be fetched while the filters below are applied
+        self._prefetch_server_details()
+
         if self.get_option("network"):
             display.vv("Choosing servers by network")
             try:
-                self.network = self._fetch_network_details(self.get_option("network"))
+                self.network = self._get_prefetched("network", self._fetch_network_details, self.get_option("network"))
             except UpCloudAPIError as exp:
                 raise AnsibleError(str(exp))
 
@@ -251,7 +758,7 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
             wanted_group = self.get_option("server_group")
 
             try:
-                raw_groups = self._fetch_server_groups()
+                raw_groups = self._get_prefetched("server_groups", self._fetch_server_groups)
                 groups = raw_groups["server_groups"]["server_group"]
             except UpCloudAPIError as exp:
                 raise AnsibleError(str(exp))
@@ -272,50 +779,88 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
 
             self.servers = tmp
 
-    def _get_ansible_host(self, public_ipv4, public_ipv6, util_addrs, server, server_details):
+    def _filter_shard(self):
+        shard_count = self.get_option("shard_count") or 1
+        shard_index = self.get_option("shard_index") or 0
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise AnsibleError(f"shard_index must be between 0 and {shard_count - 1} and shard_count at least 1")
+
+        if shard_count > 1:
+            display.vv(f"Choosing servers of shard {shard_index}/{shard_count}")
+            self.servers = [server for server in self.servers if _shard(server.uuid, shard_count) == shard_index]
+
+    def _get_connection_candidates(self, public_ipv4, public_ipv6, util_addrs, server, server_details):
+        """Return the available addresses of the server in the order of connect_with preference"""
         connect_with = _ensure_list(self.get_option("connect_with"))
+        candidates = []
 
         for method in connect_with:
             display.vv(f'Trying to find {method} connection method for server {server.uuid} ({server.hostname})')
 
             if method == "public_ipv4":
                 if len(public_ipv4) > 0:
-                    return public_ipv4[0]
+                    candidates.extend(public_ipv4)
                 else:
                     display.v(
                         f"No available public IPv4 addresses for server {server.uuid} ({server.hostname})")
 
             if method == "public_ipv6":
                 if len(public_ipv6) > 0:
-                    return public_ipv6[0]
+                    candidates.extend(public_ipv6)
                 else:
                     display.v(
                         f"No available public IPv6 addresses for server {server.uuid} ({server.hostname})")
             if method == "utility_ipv4":
                 if len(util_addrs) > 0:
-                    return util_addrs[0]
+                    candidates.extend(util_addrs)
                 else:
                     display.v(
                         f"No available utility addresses for server {server.uuid} ({server.hostname})")
             if method == "hostname":
-                return server.hostname
+                candidates.append(server.hostname)
             if method == "private_ipv4":
                 if self.get_option("network"):
                     for iface in server_details.networking["interfaces"]["interface"]:
                         if iface["network"] == self.network.uuid:
-                            return iface["ip_addresses"]["ip_address"][0].get("address")
+                            candidates.append(iface["ip_addresses"]["ip_address"][0].get("address"))
+                            break
                 else:
                     raise AnsibleError("You can only connect with private IPv4 if you specify a network")
 
-        raise NoAvailableAddressException(
-            f"None of the requested connection types {connect_with} are available for server {server.uuid} ({server.hostname})")
+        if not candidates:
+            raise NoAvailableAddressException(
+                f"None of the requested connection types {connect_with} are available for server {server.uuid} ({server.hostname})")
+
+        return list(dict.fromkeys(candidates))
+
+    def _get_ansible_host(self, public_ipv4, public_ipv6, util_addrs, server, server_details):
+        candidates = self._get_connection_candidates(public_ipv4, public_ipv6, util_addrs, server, server_details)
+        if self.get_option("probe_connection") and server.state == "started":
+            self._connection_candidates[server.hostname] = (server.uuid, candidates)
 
-    def _get_server_attributes(self, server):
-        server_details = self._fetch_server_details(server.uuid)
+        return candidates[0]
 
+    def _get_server_attributes(self, server, server_details):
         def _new_attribute(key, attribute):
             return {"key": key, "attribute": attribute}
 
+        if server_details is None:
+            # Only the variables available from the server listing
+            attributes = [
+                _new_attribute("id", to_native(server.uuid)),
+                _new_attribute("hostname", to_native(server.hostname)),
+                _new_attribute("state", to_native(server.state)), _new_attribute("zone", to_native(server.zone)),
+                _new_attribute("plan", to_native(server.plan)), _new_attribute("tags", list(server.tags)),
+                _new_attribute("labels", list(_parse_server_labels(server.labels["label"]))),
+                _new_attribute("server_group", to_native(server.server_group))
+            ]
+            if "hostname" in _ensure_list(self.get_option("connect_with")):
+                attributes.append(_new_attribute("ansible_host", to_native(server.hostname)))
+            if self.get_option("facts"):
+                attributes.extend(_new_attribute(key, value) for key, value in _server_facts(server).items())
+
+            return attributes
+
         attributes = [
             _new_attribute("id", to_native(server.uuid)),
             _new_attribute("hostname", to_native(server.hostname)),
@@ -356,6 +901,17 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
         if len(util_addrs) > 0:
             attributes.append(_new_attribute("utility_ip", to_native(util_addrs[0])))
 
+        if self.get_option("facts"):
+            facts = _server_facts(server)
+            facts.update(ansible_all_ipv4_addresses=ipv4_addrs, ansible_all_ipv6_addresses=ipv6_addrs)
+            attributes.extend(_new_attribute(key, value) for key, value in facts.items())
+
+        if self._loadbalancers is not None:
+            memberships = []
+            for address in ipv4_addrs + ipv6_addrs:
+                memberships.extend(self._loadbalancers.find(ip_address=address))
+            attributes.append(_new_attribute("upcloud_lb_memberships", memberships))
+
         ansible_host = self._get_ansible_host(public_ipv4, public_ipv6, util_addrs, server, server_details)
         attributes.append(_new_attribute("ansible_host", to_native(ansible_host)))
 
@@ -369,41 +925,328 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
         )
 
     def _populate(self):
-        self._initialize_upcloud_client()
-        self._get_servers()
-        self._filter_servers()
+        timeout = self.get_option("timeout")
+        self._deadline = time.monotonic() + timeout if timeout else None
+        self._degraded = {}
+        self._loadbalancers = None
+
+        self._prefetched = {}
+        self._prefetched_details = {}
+
+        concurrency = self.get_option("concurrency") or 1
+        if self._cached_snapshot is None and concurrency > 1:
+            self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        try:
+            self._populate_hosts()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _populate_hosts(self):
+        if self._cached_snapshot is not None:
+            display.vv("Using servers from the inventory cache")
+            self._load_snapshot(self._cached_snapshot)
+            self._reusable_details = self._cached_snapshot["details"]
+        else:
+            with trace.span("initialize client", "populate"):
+                self._initialize_upcloud_client()
+            self._reusable_details = self._previous_snapshot["details"] if self._previous_snapshot else {}
+
+            # Lookups used by the filters do not depend on the server listing
+            if self.get_option("network"):
+                self._prefetch("network", self._fetch_network_details, self.get_option("network"))
+            if self.get_option("server_group"):
+                self._prefetch("server_groups", self._fetch_server_groups)
+            if self.get_option("include_loadbalancers"):
+                self._prefetch("loadbalancers", self._fetch_loadbalancers)
+
+            try:
+                with trace.span("list servers", "populate"), self._request_timeout():
+                    self._get_servers()
+                with trace.span("filter servers", "populate"):
+                    self._filter_servers()
+            except ServerDetailsUnavailableException as e:
+                raise AnsibleError(f"Failed to list servers: {e}")
+
+            if self.get_option("include_loadbalancers"):
+                try:
+                    with trace.span("list load balancers", "populate"):
+                        self._loadbalancers = LoadBalancerTopology(
+                            self._get_prefetched("loadbalancers", self._fetch_loadbalancers))
+                except (UpCloudAPIError, ServerDetailsUnavailableException) as e:
+                    raise AnsibleError(f"Failed to list load balancers: {e}")
+
+        self._server_details = {}
+        self._native_groups = {}
+        self._connection_candidates = {}
 
         # Add 'upcloud' as a top group
         self.inventory.add_group(group="upcloud")
 
-        for server in self.servers:
-            display.vv(f"Evaluating server {server.uuid} ({server.hostname})")
+        processes = self.get_option("construct_processes")
+        if processes and "fork" not in multiprocessing.get_all_start_methods():
+            display.warning("construct_processes requires fork start method which is not available, constructing hosts serially")
+            processes = 0
+        probe = self.get_option("probe_connection")
+        batch_size = self.get_option("batch_size")
 
-            try:
-                attributes = self._get_server_attributes(server)
-            except NoAvailableAddressException as e:
-                display.vv(str(e))
-                display.v(
-                    f"Skipping server {server.hostname} as it doesn't have requested connection "
-                    f"type ({self.get_option('connect_with')}) available"
-                )
+        hosts = []
+        with trace.span("add hosts", "populate", servers=len(self.servers)):
+            for server in self.servers:
+                with trace.span(f"host {server.hostname}", "populate", uuid=server.uuid):
+                    host = self._get_host(server)
+                    if host is None:
+                        continue
+
+                    if processes or probe or batch_size:
+                        hosts.append(host)
+                    else:
+                        self._add_host(*host)
+
+        if probe and self._connection_candidates:
+            with trace.span("probe connections", "populate", hosts=len(self._connection_candidates)):
+                hosts = self._probe_connections(hosts)
+
+        if batch_size:
+            with trace.span("assign batches", "populate"):
+                hosts = self._assign_batches(hosts, batch_size, self.get_option("batch_max_fraction"))
+
+        if hosts and processes:
+            if self._executor is not None:
+                # Do not fork while requests for servers that were filtered out may still be running
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+            with trace.span("construct hosts", "populate", processes=processes):
+                self._add_hosts_in_processes(hosts, processes)
+        elif hosts:
+            for host in hosts:
+                self._add_host(*host)
+
+        if self._degraded:
+            action = "skipped" if self.get_option("degraded_servers") == "skip" else "added to upcloud_degraded group"
+            failures = "; ".join(f"{hostname}: {reason}" for hostname, reason in self._degraded.items())
+            display.warning(f"Details of {len(self._degraded)} servers could not be fetched, servers were {action}: {failures}")
+
+    def _get_host(self, server):
+        """Return (hostname, attributes, degraded) tuple for the server, or None if the server is skipped"""
+        display.vv(f"Evaluating server {server.uuid} ({server.hostname})")
+
+        try:
+            server_details = self._get_server_details(server)
+        except ServerDetailsUnavailableException as e:
+            self._degraded[server.hostname] = str(e)
+            if self.get_option("degraded_servers") == "skip":
+                return None
+            server_details = None
+
+        try:
+            attributes = self._get_server_attributes(server, server_details)
+        except NoAvailableAddressException as e:
+            display.vv(str(e))
+            display.v(
+                f"Skipping server {server.hostname} as it doesn't have requested connection "
+                f"type ({self.get_option('connect_with')}) available"
+            )
+            return None
+
+        return server.hostname, attributes, server_details is None
+
+    def _probe_connections(self, hosts):
+        """Replace ansible_host of the hosts with the first of their candidate addresses that accepts connections"""
+        port = self.get_option("probe_port")
+        timeout = self.get_option("probe_timeout")
+        ttl = self.get_option("probe_cache_ttl")
+        cache = FileCache("reachability", ttl) if ttl > 0 else None
+
+        chosen = {}
+        pending = {}
+        for hostname, (uuid, candidates) in self._connection_candidates.items():
+            key = f"{uuid}|{port}|{','.join(candidates)}"
+            address = cache.get(key) if cache is not None else None
+            if address in candidates:
+                chosen[hostname] = address
+            else:
+                pending[hostname] = (key, candidates)
+
+        addresses = list(dict.fromkeys(address for dummy, candidates in pending.values() for address in candidates))
+        display.vv(f"Probing {len(addresses)} addresses of {len(pending)} servers on port {port}")
+        reachable = {
+            address: bool(result)
+            for address, result, dummy in run_concurrently(
+                lambda address: _is_reachable(address, port, timeout), addresses, self.get_option("probe_concurrency"))
+        }
+
+        for hostname, (key, candidates) in pending.items():
+            address = next((address for address in candidates if reachable.get(address)), None)
+            if address is None:
+                display.v(f"None of the addresses of server {hostname} accept connections on port {port}, using {candidates[0]}")
                 continue
 
-            self.inventory.add_host(server.hostname, group="upcloud")
-            for attr in attributes:
-                self.inventory.set_variable(server.hostname, attr["key"], attr["attribute"])
+            chosen[hostname] = address
+            if cache is not None:
+                cache.set(key, address)
 
-            strict = self.get_option('strict')
+        return [
+            (hostname, _with_ansible_host(attributes, chosen[hostname]) if hostname in chosen else attributes, degraded)
+            for hostname, attributes, degraded in hosts
+        ]
+
+    def _assign_batches(self, hosts, batch_size, max_fraction):
+        """Add upcloud_batch variable to the hosts.
+
+        Hosts are placed in the first batch that has room for them in the order of the hostnames. Each zone, server group
+        and load balancer backend of a host limits the number of its hosts in a batch to max_fraction of its hosts.
+        """
+        domains = {hostname: _failure_domains(attributes) for hostname, attributes, degraded in hosts}
+
+        sizes = {}
+        for host_domains in domains.values():
+            for domain in host_domains:
+                sizes[domain] = sizes.get(domain, 0) + 1
+        limits = {domain: max(1, int(size * max_fraction)) for domain, size in sizes.items()}
+
+        # Number of hosts in each batch, and in each batch per domain
+        batches = []
+        batch_domains = []
+        first_open = 0
+        assigned = {}
+        for hostname in sorted(domains):
+            host_domains = domains[hostname]
+            index = first_open
+            while index < len(batches) and (
+                    batches[index] >= batch_size or
+                    any(batch_domains[index].get(domain, 0) >= limits[domain] for domain in host_domains)):
+                index += 1
+
+            if index == len(batches):
+                batches.append(0)
+                batch_domains.append({})
+
+            batches[index] += 1
+            for domain in host_domains:
+                batch_domains[index][domain] = batch_domains[index].get(domain, 0) + 1
+            assigned[hostname] = index + 1
+
+            while first_open < len(batches) and batches[first_open] >= batch_size:
+                first_open += 1
+
+        display.vv(f"Split {len(assigned)} hosts into {len(batches)} batches")
+
+        return [
+            (hostname, attributes + [{"key": "upcloud_batch", "attribute": assigned[hostname]}], degraded)
+            for hostname, attributes, degraded in hosts
+        ]
 
-            # Composed variables
-            self._set_composite_vars(self.get_option('compose'), self.inventory.get_host(server.hostname).get_vars(),
-                                     server.hostname, strict=strict)
+    def _add_host(self, hostname, attributes, degraded):
+        self.inventory.add_host(hostname, group="upcloud")
+        if degraded:
+            self.inventory.add_group(group="upcloud_degraded")
+            self.inventory.add_host(hostname, group="upcloud_degraded")
+
+        for attr in attributes:
+            self.inventory.set_variable(hostname, attr["key"], attr["attribute"])
+
+        if self.get_option('group_by'):
+            self._add_host_to_native_groups(hostname, {attr["key"]: attr["attribute"] for attr in attributes})
+
+        for attr in attributes:
+            if attr["key"] == "upcloud_lb_memberships":
+                self._add_host_to_loadbalancer_groups(hostname, attr["attribute"])
+            if attr["key"] == "upcloud_batch":
+                self.inventory.add_host(hostname, group=self.inventory.add_group(f"upcloud_batch_{attr['attribute']}"))
+
+        strict = self.get_option('strict')
+
+        # Composed variables
+        self._set_composite_vars(self.get_option('compose'), self.inventory.get_host(hostname).get_vars(),
+                                 hostname, strict=strict)
+
+        # Complex groups based on jinja2 conditionals, hosts that meet the conditional are added to group
+        self._add_host_to_composed_groups(self.get_option('groups'), {}, hostname, strict=strict)
+
+        # Create groups based on variable values and add the corresponding hosts to it
+        self._add_host_to_keyed_groups(self.get_option('keyed_groups'), {}, hostname, strict=strict)
+
+    def _add_hosts_in_processes(self, hosts, processes):
+        """Add hosts to the inventory by evaluating the constructed options in a pool of forked processes.
+
+        Each worker adds its hosts to a scratch inventory and records the changes. The changes are applied to the
+        inventory in the order of the hosts, so the result is the same as when adding the hosts serially.
+        """
+        global _CONSTRUCTING_PLUGIN
+
+        chunk_size = max(1, -(-len(hosts) // (processes * 4)))
+        chunks = [hosts[i:i + chunk_size] for i in range(0, len(hosts), chunk_size)]
+
+        _CONSTRUCTING_PLUGIN = self
+        try:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                for result in pool.imap(_record_hosts, chunks):
+                    if isinstance(result, _ConstructError):
+                        raise AnsibleParserError(result.message)
+
+                    for method, args, kwargs in result:
+                        getattr(self.inventory, method)(*args, **kwargs)
+        finally:
+            _CONSTRUCTING_PLUGIN = None
+
+    def _add_host_to_loadbalancer_groups(self, hostname, memberships):
+        for membership in memberships:
+            loadbalancer_group = self.inventory.add_group(self._sanitize_group_name(f"upcloud_lb_{membership['loadbalancer_name']}"))
+            backend_group = self.inventory.add_group(
+                self._sanitize_group_name(f"upcloud_lb_{membership['loadbalancer_name']}_{membership['backend']}"))
+            self.inventory.add_host(hostname, group=loadbalancer_group)
+            self.inventory.add_host(hostname, group=backend_group)
+
+    def _add_host_to_native_groups(self, hostname, hostvars):
+        """Add host to the group_by groups, group names are sanitized once per run"""
+        for attribute in self.get_option('group_by'):
+            prefix, get_keys = _GROUP_BY[attribute]
+            for key in get_keys(hostvars):
+                if not key:
+                    continue
+
+                group = self._native_groups.get((prefix, key))
+                if group is None:
+                    group = self.inventory.add_group(self._sanitize_group_name(f"{prefix}_{key}"))
+                    self._native_groups[(prefix, key)] = group
+
+                self.inventory.add_host(hostname, group=group)
+
+    def _add_change_groups(self, path):
+        """Add hosts to upcloud_added, upcloud_changed and upcloud_unchanged groups by comparing them to the previous run"""
+        baseline = FileCache("inventory-baseline", None)
+        key = os.path.abspath(path)
+        previous = baseline.get(key)
+
+        groups = {name: self.inventory.add_group(name) for name in ("upcloud_added", "upcloud_changed", "upcloud_unchanged")}
+        degraded = self.inventory.groups.get("upcloud_degraded")
+        degraded = {host.name for host in degraded.get_hosts()} if degraded is not None else set()
+
+        current = {}
+        for host in self.inventory.groups["upcloud"].get_hosts():
+            hostvars = host.get_vars()
+            uuid = hostvars["id"]
+            if host.name in degraded:
+                # Keep comparing to the last complete data of the server
+                if previous and uuid in previous:
+                    current[uuid] = previous[uuid]
+                continue
 
-            # Complex groups based on jinja2 conditionals, hosts that meet the conditional are added to group
-            self._add_host_to_composed_groups(self.get_option('groups'), {}, server.hostname, strict=strict)
+            current[uuid] = _change_digest(hostvars)
+            if previous is None or uuid not in previous:
+                group = groups["upcloud_added"]
+            elif previous[uuid] != current[uuid]:
+                group = groups["upcloud_changed"]
+            else:
+                group = groups["upcloud_unchanged"]
+            self.inventory.add_host(host.name, group=group)
 
-            # Create groups based on variable values and add the corresponding hosts to it
-            self._add_host_to_keyed_groups(self.get_option('keyed_groups'), {}, server.hostname, strict=strict)
+        if self.get_option('update_change_baseline'):
+            baseline.set(key, current)
 
     def _check_upcloud_api_installed(self):
         if not UC_AVAILABLE:
@@ -416,8 +1259,77 @@ class InventoryModule(BaseInventoryPlugin, Constructable):
 
         self._check_upcloud_api_installed()
         self._read_config_data(path)
+
+        cache_key = self.get_cache_key(path)
+        user_cache_setting = self.get_option('cache')
+        attempt_to_read_cache = user_cache_setting and cache
+        cache_needs_update = user_cache_setting and not cache
+
+        if attempt_to_read_cache:
+            try:
+                self._cached_snapshot = self._read_snapshot(cache_key)
+            except KeyError:
+                cache_needs_update = True
+
+        trace_file = self.get_option('trace_file')
+        if trace_file:
+            trace.start()
+
+        try:
+            with trace.span(f"parse {path}", "inventory", cached=self._cached_snapshot is not None):
+                self._populate()
+            if self.get_option('change_groups'):
+                with trace.span("change groups", "inventory"):
+                    self._add_change_groups(path)
+        finally:
+            if trace_file:
+                trace.stop().write(trace_file)
+                display.v(f"Wrote trace of the inventory run to {trace_file}")
+
+        if cache_needs_update:
+            self._cache[cache_key] = self._make_snapshot()
+
+    def refresh_cache(self, inventory, loader, path, full=False):
+        """Fetch servers from the API and store them in the inventory cache, returns the stored snapshot.
+
+        Unless full is set, details are fetched only for servers that are new or whose listing data has changed since the
+        cached snapshot; details of other servers are reused from it.
+        """
+        super(InventoryModule, self).parse(inventory, loader, path, cache=False)
+
+        self._check_upcloud_api_installed()
+        self._read_config_data(path)
+
+        if not self.get_option('cache') or self.get_option('cache_plugin') in ('memory', 'ansible.builtin.memory'):
+            raise AnsibleError("Refreshing the inventory cache requires enabling cache with a persistent cache plugin")
+
+        cache_key = self.get_cache_key(path)
+        if not full:
+            try:
+                self._previous_snapshot = self._read_snapshot(cache_key)
+            except KeyError:
+                pass
+
+        # Always start from a fresh server listing
+        _SHARED_SERVERS.clear()
         self._populate()
 
+        snapshot = self._make_snapshot()
+        self._cache[cache_key] = snapshot
+        self.update_cache_if_changed()
+
+        return snapshot
+
+    def cached_snapshot(self, loader, path):
+        """Return the servers stored in the inventory cache for the inventory source, or None if nothing is cached."""
+        self.loader = loader
+        self._read_config_data(path)
+
+        try:
+            return self._read_snapshot(self.get_cache_key(path))
+        except KeyError:
+            return None
+
 
 def _ensure_list(value) -> List:
     if value is None:
@@ -429,6 +1341,96 @@ def _ensure_list(value) -> List:
     return [value]
 
 
+def _resource_to_dict(resource, fields):
+    return {field: getattr(resource, field) for field in fields if hasattr(resource, field)}
+
+
+def _is_reachable(address, port, timeout):
+    try:
+        with socket.create_connection((address, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _failure_domains(attributes):
+    """Return the zone, server group and load balancer backends of a host"""
+    hostvars = {attr["key"]: attr["attribute"] for attr in attributes}
+
+    domains = {("zone", hostvars.get("zone"))}
+    if hostvars.get("server_group"):
+        domains.add(("server_group", hostvars["server_group"]))
+    for membership in hostvars.get("upcloud_lb_memberships", []):
+        domains.add(("backend", membership["loadbalancer"], membership["backend"]))
+
+    return domains
+
+
+def _with_ansible_host(attributes, address):
+    return [
+        {"key": "ansible_host", "attribute": to_native(address)} if attr["key"] == "ansible_host" else attr
+        for attr in attributes
+    ]
+
+
+def _server_facts(server):
+    """Return facts available from the server listing"""
+    facts = {}
+    if getattr(server, "core_number", None):
+        facts["ansible_processor_vcpus"] = int(server.core_number)
+        facts["ansible_processor_nproc"] = int(server.core_number)
+    if getattr(server, "memory_amount", None):
+        facts["ansible_memtotal_mb"] = int(server.memory_amount)
+
+    return facts
+
+
+def _trim_loadbalancers(loadbalancers):
+    """Return the load balancer fields needed for backend memberships"""
+    return [
+        {
+            "uuid": loadbalancer.get("uuid"),
+            "name": loadbalancer.get("name"),
+            "backends": [
+                {
+                    "name": backend.get("name"),
+                    "members": [
+                        {
+                            "name": member.get("name"),
+                            "ip": member_ip_address(member),
+                            "port": member.get("port"),
+                            "weight": member.get("weight"),
+                            "enabled": member.get("enabled"),
+                        }
+                        for member in backend.get("members") or []
+                    ],
+                }
+                for backend in loadbalancer.get("backends") or []
+            ],
+        }
+        for loadbalancer in loadbalancers
+    ]
+
+
+def _fingerprint(server):
+    """Return a string that changes when the listing data of the server changes"""
+    return json.dumps(_resource_to_dict(server, _LISTING_FIELDS), sort_keys=True, default=str)
+
+
+def _change_digest(hostvars):
+    """Return a digest of the host variables compared by change_groups"""
+    fields = {field: hostvars.get(field) for field in _CHANGE_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _shard(uuid, shard_count):
+    """Return the shard of the server with the highest hash of shard and UUID"""
+    return max(
+        range(shard_count),
+        key=lambda shard: hashlib.sha256(f"{shard}|{uuid}".encode()).digest(),
+    )
+
+
 def _ordered_intersection(a, b):
     b_dict = {i: True for i in b}
     return [i for i in a if i in b_dict]
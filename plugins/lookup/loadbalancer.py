@@ -0,0 +1,146 @@
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+    name: loadbalancer
+    author:
+      - UpCloud (@UpCloudLtd)
+    short_description: Look up backend memberships of an UpCloud load balancer.
+    version_added: "0.11.0"
+    requirements:
+        - python >= 3.7
+        - upcloud-api >= 2.5.0
+    description:
+        - Fetches the backends and members of the given load balancers and returns the memberships that match
+          O(member_name) and/or O(ip_address), or all memberships if neither is given.
+        - The load balancer is fetched once and cached on the controller for O(cache_ttl) seconds, so the lookup
+          can be used from every host of a play without additional API requests.
+        - API credentials are read from the same environment variables or system keyring as the modules use.
+    options:
+        _terms:
+            description: UUIDs of the load balancers.
+            required: true
+        member_name:
+            description: Return memberships of the backend member with this name.
+            type: str
+            required: false
+        ip_address:
+            description: Return memberships of the backend member with this IP address.
+            type: str
+            required: false
+        cache_ttl:
+            description:
+                - Number of seconds to cache the load balancer on disk.
+                - Set to V(0) to fetch the load balancer once per process only.
+            type: int
+            default: 300
+        refresh:
+            description: Fetch the load balancer from the API even if it is cached.
+            type: bool
+            default: false
+'''
+
+EXAMPLES = r'''
+- name: Find the backend member of the current host
+  ansible.builtin.set_fact:
+    lb_membership: "{{ lookup('upcloud.cloud.loadbalancer', loadbalancer_uuid, ip_address=backend_ip) }}"
+
+- name: Disable new connections to the current host
+  upcloud.cloud.loadbalancer_backend_member:
+    loadbalancer_uuid: "{{ loadbalancer_uuid }}"
+    backend_name: "{{ lb_membership.backend }}"
+    member_name: "{{ lb_membership.member }}"
+    weight: 0
+
+- name: List all backend members of a load balancer
+  ansible.builtin.debug:
+    msg: "{{ query('upcloud.cloud.loadbalancer', loadbalancer_uuid) }}"
+'''
+
+RETURN = r'''
+    _raw:
+        description: Matching backend memberships.
+        type: list
+        elements: dict
+        contains:
+            loadbalancer:
+                description: UUID of the load balancer.
+                type: str
+            loadbalancer_name:
+                description: Name of the load balancer.
+                type: str
+            backend:
+                description: Name of the backend.
+                type: str
+            member:
+                description: Name of the backend member.
+                type: str
+            ip_address:
+                description: IP address of the backend member.
+                type: str
+            port:
+                description: Port of the backend member.
+                type: int
+            weight:
+                description: Weight of the backend member.
+                type: int
+            enabled:
+                description: Whether the backend member is enabled.
+                type: bool
+'''
+
+import time
+
+from ansible.errors import AnsibleLookupError
+from ansible.plugins.lookup import LookupBase
+
+from ..module_utils.cache import FileCache
+from ..module_utils.client import client_cache_key, get_upcloud_client
+from ..module_utils.loadbalancer import LoadBalancerTopology
+
+try:
+    from upcloud_api.errors import UpCloudAPIError
+except ImportError:
+    UpCloudAPIError = RuntimeError
+
+
+# Load balancers fetched in this process, keyed by credentials and UUID
+_LOADBALANCERS = {}
+
+
+class LookupModule(LookupBase):
+    def _fetch_loadbalancer(self, uuid):
+        return get_upcloud_client().api.get_request(f'/load-balancer/{uuid}')
+
+    def _get_loadbalancer(self, uuid):
+        key = f"{client_cache_key()}|{uuid}"
+        ttl = self.get_option('cache_ttl')
+        refresh = self.get_option('refresh')
+
+        cached = _LOADBALANCERS.get(key)
+        if cached is not None and not refresh and (ttl <= 0 or time.monotonic() - cached[0] <= ttl):
+            return cached[1]
+
+        cache = FileCache('loadbalancer', ttl) if ttl > 0 else None
+        loadbalancer = cache.get(key) if cache is not None and not refresh else None
+
+        if loadbalancer is None:
+            loadbalancer = self._fetch_loadbalancer(uuid)
+            if cache is not None:
+                cache.set(key, loadbalancer)
+
+        _LOADBALANCERS[key] = (time.monotonic(), loadbalancer)
+        return loadbalancer
+
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+
+        ret = []
+        for uuid in terms:
+            try:
+                topology = LoadBalancerTopology([self._get_loadbalancer(uuid)])
+            except (RuntimeError, UpCloudAPIError) as e:
+                raise AnsibleLookupError(f"Failed to fetch load balancer {uuid}: {e}")
+
+            ret.extend(topology.find(self.get_option('member_name'), self.get_option('ip_address')))
+
+        return ret
@@ -0,0 +1,204 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ansible_collections.upcloud.cloud.plugins.module_utils import trace
+from ansible_collections.upcloud.cloud.plugins.module_utils.ratelimit import RateLimiter
+
+try:
+    import requests
+    from upcloud_api.api import API
+    from upcloud_api.errors import UpCloudAPIError
+except ImportError:
+    API = object
+
+try:
+    from orjson import loads as decode_json
+except ImportError:
+    decode_json = json.loads
+
+
+MEMO_TTL_ENV = "UPCLOUD_API_MEMO_TTL"
+
+DEFAULT_MEMO_TTL = 2
+MEMO_SIZE = 128
+
+# Throttled requests are retried after the Retry-After time or exponential backoff, capped to this many seconds
+THROTTLE_RETRIES = 5
+THROTTLE_MAX_DELAY = 30
+
+_UNSET = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class UpCloudAPI(API):
+    """API client that keeps the HTTP connections open between requests.
+
+    Responses are requested compressed and decoded with orjson when it is installed.
+
+    Identical GET requests made at the same time share one request to the API, and successful responses are
+    remembered for a few seconds (``UPCLOUD_API_MEMO_TTL``, ``0`` disables). Any other request clears the
+    remembered responses, so changes made through the client are visible right away.
+
+    Requests draw from the rate budget shared by all processes using the same account, see ``ratelimit``.
+    """
+
+    def __init__(self, token, timeout=None):
+        super().__init__(token, timeout)
+        self.memo_ttl = float(os.getenv(MEMO_TTL_ENV, DEFAULT_MEMO_TTL))
+        self._generation = 0
+        self._local = threading.local()
+        self._limiter = None
+        self._reset()
+
+    def _reset(self):
+        """Create the connection pool and request state for the current process."""
+        self._pid = os.getpid()
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()
+        self._in_flight = {}
+
+    def _check_process(self):
+        # Clients created before a fork, e.g. by an inventory plugin in the main ansible process, must not share the
+        # open connections and locks of the parent process with the forked workers.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def api_request(self, method, endpoint, body=None, params=None, timeout=-1):
+        if method not in {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}:
+            raise Exception('Invalid/Forbidden HTTP method')
+
+        call_timeout = timeout if timeout != -1 else getattr(self._local, 'timeout', self.timeout)
+        status, res_json = self._request(method, endpoint, body, params, call_timeout)
+
+        return _check_response(status, res_json)
+
+    @contextmanager
+    def timeout_override(self, timeout):
+        """Use timeout instead of the client timeout for requests made by the current thread within the block."""
+        previous = self._local.__dict__.get('timeout', _UNSET)
+        self._local.timeout = timeout
+        try:
+            yield
+        finally:
+            if previous is _UNSET:
+                del self._local.timeout
+            else:
+                self._local.timeout = previous
+
+    def _request(self, method, endpoint, body, params, timeout):
+        self._check_process()
+
+        if method != 'GET':
+            try:
+                return self._send(method, endpoint, body, params, timeout)
+            finally:
+                with self._lock:
+                    self._generation += 1
+                    self._memo.clear()
+
+        key = (endpoint, tuple(sorted((params or {}).items())))
+
+        with self._lock:
+            memo = self._memo.get(key)
+            if memo is not None and memo[0] > time.monotonic():
+                self._memo.move_to_end(key)
+                return memo[1], copy.deepcopy(memo[2])
+
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                generation = self._generation
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.response[0], copy.deepcopy(call.response[1])
+
+        try:
+            call.response = self._send(method, endpoint, body, params, timeout)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if call.error is None and call.response[0] < 400 and self.memo_ttl > 0 and generation == self._generation:
+                    self._memo[key] = (time.monotonic() + self.memo_ttl,) + call.response
+                    while len(self._memo) > MEMO_SIZE:
+                        self._memo.popitem(last=False)
+            call.done.set()
+
+        return call.response[0], copy.deepcopy(call.response[1])
+
+    @property
+    def limiter(self):
+        key = hashlib.sha256(f'{self.token}|{self.api_root}'.encode()).hexdigest()[:24]
+        if self._limiter is None or self._limiter.key != key:
+            self._limiter = RateLimiter(key)
+        return self._limiter
+
+    def _send(self, method, endpoint, body, params, timeout):
+        headers = {'Authorization': self.token, 'User-Agent': self.user_agent}
+
+        if body:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        else:
+            data = None
+
+        for attempt in range(THROTTLE_RETRIES + 1):
+            waited = self.limiter.acquire()
+            with trace.span(f'{method} {endpoint}', 'http', method=method, endpoint=endpoint) as span:
+                res = self.session.request(
+                    method=method, url=f'{self.api_root}{endpoint}', data=data, params=params, headers=headers, timeout=timeout
+                )
+                span.update(status=res.status_code, bytes=len(res.content), rate_limit_wait=waited)
+
+            if res.status_code != 429 or attempt == THROTTLE_RETRIES:
+                break
+
+            # The request was not processed, so it can be retried once all processes of the account have backed off
+            self.limiter.backoff(_retry_after(res) or min(2 ** attempt, THROTTLE_MAX_DELAY))
+
+        # Responses are UTF-8 JSON, decode the bytes directly instead of detecting the encoding of the text
+        return res.status_code, decode_json(res.content) if res.content else {}
+
+
+def _retry_after(res):
+    try:
+        return min(float(res.headers.get('Retry-After')), THROTTLE_MAX_DELAY)
+    except (TypeError, ValueError):
+        return None
+
+
+def _check_response(status, res_json):
+    if status >= 400:
+        if res_json.get('type'):
+            raise UpCloudAPIError(
+                error_code=res_json.get('title'),
+                error_message=f'Details: {json.dumps(res_json)}',
+            )
+
+        err_dict = res_json.get('error', {})
+        raise UpCloudAPIError(
+            error_code=err_dict.get('error_code'), error_message=err_dict.get('error_message')
+        )
+
+    return res_json
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+CACHE_DIR_ENV = "UPCLOUD_CACHE_DIR"
+
+
+def cache_dir():
+    directory = os.getenv(CACHE_DIR_ENV) or os.path.expanduser("~/.ansible/upcloud/cache")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+
+class FileCache:
+    """JSON values cached on disk for a limited time, shared by all processes of the current user.
+
+    Values are written atomically, so a concurrent reader sees either the previous or the new value.
+    """
+
+    def __init__(self, namespace, ttl, directory=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.directory = directory or cache_dir()
+
+    def _path(self, key):
+        digest = hashlib.sha256(f"{self.namespace}|{key}".encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{self.namespace}-{digest}.json")
+
+    def get(self, key):
+        """Return the cached value or None if it is missing or older than the TTL."""
+        path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
@@ -1,5 +1,9 @@
+import hashlib
 import os
 
+from ansible_collections.upcloud.cloud.plugins.module_utils import persistent
+from ansible_collections.upcloud.cloud.plugins.module_utils.api import UpCloudAPI
+
 try:
     import upcloud_api
     from upcloud_api.errors import UpCloudAPIError
@@ -11,6 +15,9 @@ except ImportError:
 # This value will be replaced in build-and-release workflow
 VERSION = "dev"
 
+# Authenticated clients created in this process, keyed by credentials and API root
+_CLIENTS = {}
+
 
 def initialize_upcloud_client(username=None, password=None, token=None):
     if not UC_AVAILABLE:
@@ -37,6 +44,8 @@ def initialize_upcloud_client(username=None, password=None, token=None):
                 'Update upcloud-api to version 2.8.0 or later.'
             ) from None
 
+    client.api = UpCloudAPI(client.api.token, client.api.timeout)
+
     version = VERSION
     client.api.user_agent = f"upcloud-ansible-collection/{version}"
 
@@ -44,9 +53,42 @@ def initialize_upcloud_client(username=None, password=None, token=None):
     if os.getenv(api_root_env):
         client.api.api_root = os.getenv(api_root_env)
 
+    if persistent.is_enabled():
+        # Requests are sent through the helper process if it is running or can be started, otherwise directly.
+        persistent_api = persistent.connect(client.api)
+        if persistent_api is not None:
+            client.api = persistent_api
+            return client
+
     try:
         client.authenticate()
     except UpCloudAPIError:
         raise RuntimeError("Invalid UpCloud API credentials.")
 
     return client
+
+
+def client_cache_key(username=None, password=None, token=None):
+    """Return an identifier for the credentials and API root that can be used as a cache key without contacting the API."""
+    try:
+        authorization = upcloud_api.Credentials.parse(username=username, password=password, token=token).authorization
+    except Exception:
+        authorization = "|".join(str(i) for i in (
+            username or os.getenv("UPCLOUD_USERNAME"),
+            password or os.getenv("UPCLOUD_PASSWORD"),
+            token or os.getenv("UPCLOUD_TOKEN"),
+        ))
+
+    return hashlib.sha256(f"{authorization}|{os.getenv('UPCLOUD_API_ROOT', '')}".encode()).hexdigest()
+
+
+def get_upcloud_client(username=None, password=None, token=None):
+    """Return an authenticated client, reusing one created earlier in this process with the same credentials."""
+    key = client_cache_key(username, password, token)
+
+    client = _CLIENTS.get(key)
+    if client is None:
+        client = initialize_upcloud_client(username, password, token)
+        _CLIENTS[key] = client
+
+    return client
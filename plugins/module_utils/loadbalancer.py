@@ -0,0 +1,201 @@
+from ansible_collections.upcloud.cloud.plugins.module_utils.client import initialize_upcloud_client
+
+
+def loadbalancer_backend_member_argument_spec():
+    return dict(
+        loadbalancer_uuid=dict(type='str', required=True),
+        backend_name=dict(type='str', required=True),
+        member_name=dict(type='str', required=False),
+        ip_address=dict(type='str', required=False),
+        members=dict(type='list', elements='dict', required=False, options=dict(
+            member_name=dict(type='str', required=False),
+            ip_address=dict(type='str', required=False),
+        )),
+        weight=dict(type='int', required=True),
+    )
+
+
+LOADBALANCER_BACKEND_MEMBER_MUTUALLY_EXCLUSIVE = [
+    ('members', 'member_name'),
+    ('members', 'ip_address'),
+]
+
+
+def member_ip_address(member):
+    # Backend members expose their address as "ip", accept "ip_address" as well.
+    return member.get('ip') or member.get('ip_address')
+
+
+class LoadBalancerTopology:
+    """Backend members of one or more load balancers, indexed by member name and IP address."""
+
+    def __init__(self, loadbalancers):
+        self.loadbalancers = loadbalancers
+        self.memberships = []
+        self._by_name = {}
+        self._by_ip = {}
+
+        for loadbalancer in loadbalancers:
+            for backend in loadbalancer.get('backends') or []:
+                for member in backend.get('members') or []:
+                    membership = {
+                        'loadbalancer': loadbalancer.get('uuid'),
+                        'loadbalancer_name': loadbalancer.get('name'),
+                        'backend': backend.get('name'),
+                        'member': member.get('name'),
+                        'ip_address': member_ip_address(member),
+                        'port': member.get('port'),
+                        'weight': member.get('weight'),
+                        'enabled': member.get('enabled'),
+                    }
+                    self.memberships.append(membership)
+                    self._by_name.setdefault(membership['member'], []).append(membership)
+                    if membership['ip_address']:
+                        self._by_ip.setdefault(membership['ip_address'], []).append(membership)
+
+    def find(self, member_name=None, ip_address=None):
+        """Return memberships matching the member name and/or IP address, or all memberships if neither is given."""
+        if member_name is None and ip_address is None:
+            return list(self.memberships)
+
+        if member_name is not None:
+            found = self._by_name.get(member_name, [])
+            if ip_address is not None:
+                found = [i for i in found if i['ip_address'] == ip_address]
+            return list(found)
+
+        return list(self._by_ip.get(ip_address, []))
+
+
+class LoadBalancerBackendMember:
+    def __init__(self, loadbalancer_uuid=None, backend_name=None, member_name=None, ip_address=None, client=None):
+        self.client = client or initialize_upcloud_client()
+
+        self.loadbalancer_uuid = loadbalancer_uuid
+        self.backend_name = backend_name
+        self.member_name = member_name
+        self.ip_address = ip_address
+        self.weight = None
+
+        if self.member_name is None and self.ip_address is None:
+            raise ValueError('Either member_name or ip_address must be provided.')
+
+        self.details = dict()
+
+    @property
+    def _url(self):
+        return f'/load-balancer/{self.loadbalancer_uuid}/backends/{self.backend_name}/members/{self.member_name}'
+
+    def _get_by_ip(self):
+        backend = LoadBalancerBackend(self.loadbalancer_uuid, self.backend_name, client=self.client)
+        backend.read()
+        member = backend.find(ip_address=self.ip_address)
+        self.member_name = member.get('name')
+        return member
+
+    def read(self):
+        if self.member_name is None:
+            self.details = self._get_by_ip()
+        else:
+            self.details = self.client.api.get_request(self._url)
+        self.weight = int(self.details.get('weight'))
+
+    def update(self, weight):
+        payload = {
+            'weight': weight
+        }
+        self.details = self.client.api.patch_request(self._url, payload)
+        self.weight = weight
+
+
+class LoadBalancerBackend:
+    """Members of a single load balancer backend, read with one request and updated together."""
+
+    def __init__(self, loadbalancer_uuid=None, backend_name=None, client=None):
+        self.client = client or initialize_upcloud_client()
+
+        self.loadbalancer_uuid = loadbalancer_uuid
+        self.backend_name = backend_name
+        self.members = []
+        self._by_name = {}
+        self._by_ip = {}
+
+    @property
+    def _url(self):
+        return f'/load-balancer/{self.loadbalancer_uuid}/backends/{self.backend_name}/members'
+
+    def read(self):
+        self.members = self.client.api.get_request(self._url)
+        self._by_name = {member.get('name'): member for member in self.members}
+        self._by_ip = {}
+        for member in self.members:
+            self._by_ip.setdefault(member_ip_address(member), member)
+
+    def find(self, member_name=None, ip_address=None):
+        if member_name is None and ip_address is None:
+            raise ValueError('Either member_name or ip_address must be provided.')
+
+        if member_name is not None:
+            if member_name not in self._by_name:
+                raise ValueError(f'Backend member {member_name} not found.')
+            return self._by_name[member_name]
+
+        if ip_address not in self._by_ip:
+            raise ValueError(f'Backend member with IP address {ip_address} not found.')
+        return self._by_ip[ip_address]
+
+    def set_weight(self, wanted, weight, check_mode=False):
+        """Set weight of the wanted members, returns (changed, member details) tuple.
+
+        Members are looked up from a single read of the backend; only members whose weight differs are updated.
+        """
+        changed = False
+        details = []
+
+        for item in wanted:
+            member = self.find(item.get('member_name'), item.get('ip_address'))
+            if int(member.get('weight')) != weight:
+                changed = True
+                if not check_mode:
+                    member = self.client.api.patch_request(f"{self._url}/{member.get('name')}", {'weight': weight})
+            details.append(member)
+
+        return changed, details
+
+
+def update_backend_members(params, check_mode=False, client=None):
+    """Apply loadbalancer_backend_member parameters and return the result dict."""
+    result = dict(
+        changed=False,
+        loadbalancer_backend_member={},
+    )
+
+    weight = params.get('weight')
+
+    if params.get('members'):
+        backend = LoadBalancerBackend(
+            loadbalancer_uuid=params.get('loadbalancer_uuid'),
+            backend_name=params.get('backend_name'),
+            client=client,
+        )
+        backend.read()
+        result['changed'], result['loadbalancer_backend_members'] = backend.set_weight(params.get('members'), weight, check_mode)
+        return result
+
+    member = LoadBalancerBackendMember(
+        loadbalancer_uuid=params.get('loadbalancer_uuid'),
+        backend_name=params.get('backend_name'),
+        member_name=params.get('member_name'),
+        ip_address=params.get('ip_address'),
+        client=client,
+    )
+    member.read()
+    result['loadbalancer_backend_member'] = member.details
+
+    if member.weight != weight:
+        if not check_mode:
+            member.update(weight)
+            result['loadbalancer_backend_member'] = member.details
+        result["changed"] = True
+
+    return result
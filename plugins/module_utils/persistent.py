@@ -0,0 +1,268 @@
+"""Optional helper process that keeps an authenticated API session open between module runs.
+
+Enable by setting ``UPCLOUD_PERSISTENT_CLIENT=true``. The first client that needs the helper starts it in the
+background; it listens on a Unix socket that is only accessible by the current user and exits after
+``UPCLOUD_PERSISTENT_IDLE_TIMEOUT`` seconds (default 300) without requests.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import select
+import socket
+import socketserver
+import threading
+import time
+
+from ansible_collections.upcloud.cloud.plugins.module_utils import trace
+from ansible_collections.upcloud.cloud.plugins.module_utils.api import UpCloudAPI, decode_json
+
+try:
+    import requests
+except ImportError:
+    pass
+
+
+ENABLE_ENV = "UPCLOUD_PERSISTENT_CLIENT"
+DIR_ENV = "UPCLOUD_PERSISTENT_DIR"
+IDLE_TIMEOUT_ENV = "UPCLOUD_PERSISTENT_IDLE_TIMEOUT"
+
+DEFAULT_IDLE_TIMEOUT = 300
+START_TIMEOUT = 30
+
+
+def is_enabled():
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "fork"):
+        return False
+
+    return os.getenv(ENABLE_ENV, "").lower() in ("1", "true", "yes", "on")
+
+
+def socket_path(api):
+    directory = os.getenv(DIR_ENV) or os.path.expanduser("~/.ansible/upcloud")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    key = hashlib.sha256(f"{api.token}|{api.api_root}".encode()).hexdigest()[:24]
+    return os.path.join(directory, f"{key}.sock")
+
+
+def connect(api):
+    """Return an API client that forwards requests to the helper process, starting the helper if needed.
+
+    Returns None if the helper is not available, in which case requests should be sent directly.
+    """
+    try:
+        path = socket_path(api)
+        proxy = SocketAPI(path, api)
+        if proxy.ping():
+            return proxy
+
+        with open(f"{path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if proxy.ping() or _start(api, path):
+                return proxy
+    except OSError:
+        pass
+
+    return None
+
+
+class SocketAPI(UpCloudAPI):
+    """API client that sends requests through the helper process and falls back to direct requests."""
+
+    def __init__(self, path, api):
+        super().__init__(api.token, api.timeout)
+        self.api_root = api.api_root
+        self.user_agent = api.user_agent
+        self.path = path
+        self._conn = None
+
+    def _reset(self):
+        super()._reset()
+        self._conn = None
+
+    def ping(self):
+        self._check_process()
+        try:
+            return self._forward({"method": "PING"}).get("status") == 200
+        except (OSError, ValueError):
+            self._close()
+            return False
+
+    def _send(self, method, endpoint, body, params, timeout):
+        request = {"method": method, "endpoint": endpoint, "body": body, "params": params, "timeout": timeout}
+
+        try:
+            self._write(request)
+        except OSError:
+            # The helper is gone, e.g. it exited after being idle. Nothing was sent, so it is safe to retry directly.
+            self._close()
+            return super()._send(method, endpoint, body, params, timeout)
+
+        with trace.span(f"{method} {endpoint}", "http", method=method, endpoint=endpoint, helper=True) as span:
+            response = self._read()
+            span.update(status=response.get("status"))
+
+        if "error" in response:
+            raise requests.exceptions.RequestException(response["error"])
+
+        return response["status"], response["body"]
+
+    def _forward(self, request):
+        self._write(request)
+        return self._read()
+
+    def _write(self, request):
+        if self._conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._conn = sock.makefile("rwb")
+            sock.close()
+
+        self._conn.write(json.dumps(request).encode() + b"\n")
+        self._conn.flush()
+
+    def _read(self):
+        line = self._conn.readline()
+        if not line:
+            self._close()
+            raise OSError("Connection to UpCloud API helper process closed unexpectedly")
+
+        return decode_json(line)
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+        self._conn = None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connection_opened()
+        try:
+            for line in self.rfile:
+                self.wfile.write(json.dumps(self.server.handle_request_line(line)).encode() + b"\n")
+                self.wfile.flush()
+        finally:
+            self.server.connection_closed()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, api):
+        super().__init__(path, _Handler)
+        self.api = api
+        self.active = 0
+        self.last_activity = time.monotonic()
+        self._lock = threading.Lock()
+
+    def connection_opened(self):
+        with self._lock:
+            self.active += 1
+            self.last_activity = time.monotonic()
+
+    def connection_closed(self):
+        with self._lock:
+            self.active -= 1
+            self.last_activity = time.monotonic()
+
+    def idle_for(self):
+        with self._lock:
+            return 0 if self.active else time.monotonic() - self.last_activity
+
+    def handle_request_line(self, line):
+        request = json.loads(line)
+        if request.get("method") == "PING":
+            return {"status": 200, "body": {}}
+
+        try:
+            status, body = self.api._request(
+                request["method"], request["endpoint"], request.get("body"), request.get("params"), request.get("timeout"))
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+
+        return {"status": status, "body": body}
+
+
+def serve(api, path, idle_timeout=DEFAULT_IDLE_TIMEOUT, ready=None):
+    """Serve requests on the Unix socket until no requests have been received for idle_timeout seconds.
+
+    The optional ready callback is called once the socket is accepting connections.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+
+    old_umask = os.umask(0o177)
+    try:
+        server = _Server(path, api)
+    finally:
+        os.umask(old_umask)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    if ready is not None:
+        ready()
+
+    try:
+        while server.idle_for() < idle_timeout:
+            time.sleep(1)
+    finally:
+        server.shutdown()
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _start(api, path):
+    """Start the helper process in the background and wait until it has authenticated and is listening."""
+    idle_timeout = int(os.getenv(IDLE_TIMEOUT_ENV, DEFAULT_IDLE_TIMEOUT))
+    read_fd, write_fd = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _daemonize(api, path, idle_timeout, write_fd)
+
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+
+    try:
+        ready, dummy, dummy = select.select([read_fd], [], [], START_TIMEOUT)
+        return bool(ready) and os.read(read_fd, 1) == b"1"
+    finally:
+        os.close(read_fd)
+
+
+def _daemonize(api, path, idle_timeout, ready_fd):
+    status = 1
+    try:
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+
+        # Detach from the stdout and stderr of the module, Ansible waits for those to be closed.
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        os.close(devnull)
+
+        try:
+            api.api_request("GET", "/account")
+        except Exception:
+            os.write(ready_fd, b"0")
+            return
+
+        serve(api, path, idle_timeout, ready=lambda: os.write(ready_fd, b"1"))
+        status = 0
+    finally:
+        os._exit(status)
@@ -0,0 +1,94 @@
+"""Request budget shared by all processes of the current user that use the same UpCloud account.
+
+Set ``UPCLOUD_API_RATE_LIMIT`` to the number of requests per second that all processes together may send, for example
+the forks of a playbook run. Bursts of up to ``UPCLOUD_API_RATE_BURST`` requests (default: one second worth of
+requests) are sent without waiting. The budget is kept in a small state file that is locked while it is updated.
+
+Throttled (429) responses pause the requests of all processes of the account, also when no rate limit is set.
+"""
+
+import fcntl
+import json
+import os
+import time
+
+from ansible_collections.upcloud.cloud.plugins.module_utils.cache import cache_dir
+
+
+RATE_LIMIT_ENV = "UPCLOUD_API_RATE_LIMIT"
+RATE_BURST_ENV = "UPCLOUD_API_RATE_BURST"
+
+
+class RateLimiter:
+    """Token bucket stored in a file, so that every process drawing from the same key shares one budget."""
+
+    def __init__(self, key, rate=None, burst=None, directory=None):
+        self.key = key
+        self.rate = float(os.getenv(RATE_LIMIT_ENV, 0)) if rate is None else rate
+        if burst is None:
+            burst = float(os.getenv(RATE_BURST_ENV, 0)) or max(1.0, self.rate)
+        self.burst = burst
+        self._directory = directory
+
+    @property
+    def path(self):
+        directory = self._directory or cache_dir()
+        return os.path.join(directory, f"ratelimit-{self.key}.json")
+
+    def _update(self, func):
+        """Call func with the state and the current time while holding the lock, store the state it returns."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 4096)
+            try:
+                state = json.loads(data) if data else {}
+            except ValueError:
+                state = {}
+
+            now = time.time()
+            state, result = func(state, now)
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps(state).encode())
+            return result
+        finally:
+            os.close(fd)
+
+    def _take(self, state, now):
+        blocked_until = state.get("blocked_until", 0)
+        if now < blocked_until:
+            return state, blocked_until - now
+
+        if self.rate <= 0:
+            return state, 0
+
+        elapsed = max(0.0, now - state.get("updated", now))
+        tokens = min(self.burst, state.get("tokens", self.burst) + elapsed * self.rate)
+        if tokens >= 1:
+            return dict(state, tokens=tokens - 1, updated=now), 0
+
+        return dict(state, tokens=tokens, updated=now), (1 - tokens) / self.rate
+
+    def acquire(self):
+        """Wait until a request may be sent, returns the number of seconds waited."""
+        if self.rate <= 0 and not os.path.exists(self.path):
+            # Nothing has been throttled and there is no budget to share
+            return 0
+
+        waited = 0
+        while True:
+            wait = self._update(self._take)
+            if wait <= 0:
+                return waited
+
+            time.sleep(wait)
+            waited += wait
+
+    def backoff(self, seconds):
+        """Pause the requests of all processes sharing the budget for the given number of seconds."""
+        def _block(state, now):
+            return dict(state, blocked_until=max(state.get("blocked_until", 0), now + seconds), tokens=0, updated=now), None
+
+        self._update(_block)
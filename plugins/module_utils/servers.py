@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def list_servers(client):
+    """Return the server listing as a list of dicts with a single request."""
+    return client.api.get_request('/server')['servers']['server']
+
+
+def resolve_servers(listing, names):
+    """Map UUIDs or hostnames to servers of the listing, returns (servers, unknown names) tuple.
+
+    Servers are returned in the order of the names, each server at most once.
+    """
+    by_uuid = {server['uuid']: server for server in listing}
+    by_hostname = {}
+    for server in listing:
+        by_hostname.setdefault(server['hostname'], server)
+
+    servers = []
+    seen = set()
+    unknown = []
+    for name in names:
+        server = by_uuid.get(name) or by_hostname.get(name)
+        if server is None:
+            unknown.append(name)
+        elif server['uuid'] not in seen:
+            seen.add(server['uuid'])
+            servers.append(server)
+
+    return servers, unknown
+
+
+def match_servers(listing, zones=None, states=None, tags=None, labels=None):
+    """Return the servers of the listing that match all of the given filters.
+
+    Each filter matches servers with any of its values. Labels match by key, value or key=value as in the servers inventory.
+    """
+    def _matches(server):
+        if zones and server['zone'] not in zones:
+            return False
+        if states and server['state'] not in states:
+            return False
+        if tags and not set(tags) & set((server.get('tags') or {}).get('tag', [])):
+            return False
+        if labels:
+            server_labels = set()
+            for label in (server.get('labels') or {}).get('label', []):
+                server_labels.update((label['key'], label['value'], f"{label['key']}={label['value']}"))
+            if not set(labels) & server_labels:
+                return False
+        return True
+
+    return [server for server in listing if _matches(server)]
+
+
+def run_concurrently(func, items, parallelism):
+    """Call func for each item with at most parallelism calls in flight.
+
+    Returns a list of (item, result, exception) tuples in the order of the items.
+    """
+    def _call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(items)))) as executor:
+        return list(executor.map(_call, items))
@@ -0,0 +1,84 @@
+"""Opt-in timeline of API requests and inventory phases in Chrome trace event format.
+
+Traces can be opened in any viewer that supports the format, for example https://ui.perfetto.dev or chrome://tracing.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+_ACTIVE = None
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, category, start, end, args):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path):
+        with self._lock:
+            events = list(self.events)
+
+        threads = {(event["pid"], event["tid"]) for event in events}
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": f"thread {tid}"}}
+            for pid, tid in sorted(threads)
+        ]
+
+        with open(os.path.expanduser(path), "w") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+
+
+def start():
+    """Start recording spans of all threads of this process, returns the tracer."""
+    global _ACTIVE
+    _ACTIVE = Tracer()
+    return _ACTIVE
+
+
+def stop():
+    global _ACTIVE
+    tracer, _ACTIVE = _ACTIVE, None
+    return tracer
+
+
+def active():
+    return _ACTIVE
+
+
+@contextmanager
+def span(name, category, **args):
+    """Record the duration of the block as a span if tracing is active.
+
+    Yields the dict of span arguments, so that results such as response status can be added to the span.
+    """
+    tracer = _ACTIVE
+    if tracer is None:
+        yield args
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield args
+    except Exception as e:
+        args["error"] = str(e)
+        raise
+    finally:
+        tracer.add_span(name, category, start_time, time.perf_counter(), args)
@@ -0,0 +1,324 @@
+__metaclass__ = type
+
+
+DOCUMENTATION = r'''
+---
+module: server_labels
+version_added: "0.11.0"
+short_description: Set labels and tags of multiple UpCloud servers
+description:
+    - Add, remove or replace labels and tags of a list of UpCloud servers, or of the servers matching filters, with one task.
+    - The servers that need changes are determined from a single server listing. Only those servers are modified, and the
+      modifications are sent concurrently.
+options:
+    servers:
+        description:
+            - UUIDs or hostnames of the servers.
+            - Either O(servers) or O(filters) is required. When both are given, the listed servers that match the filters
+              are modified.
+        required: false
+        type: list
+        elements: str
+    filters:
+        description:
+            - Modify the servers that match all of the given filters.
+        required: false
+        type: dict
+        suboptions:
+            zones:
+                description: Servers in any of these zones.
+                type: list
+                elements: str
+            states:
+                description: Servers in any of these states.
+                type: list
+                elements: str
+            tags:
+                description: Servers with any of these tags.
+                type: list
+                elements: str
+            labels:
+                description: Servers with any of these labels, either just key or value ("foo" or "bar") or as a whole label ("foo=bar").
+                type: list
+                elements: str
+    labels:
+        description:
+            - Labels to add or update.
+        required: false
+        type: dict
+        default: {}
+    remove_labels:
+        description:
+            - Keys of the labels to remove.
+        required: false
+        type: list
+        elements: str
+        default: []
+    purge_labels:
+        description:
+            - Remove the labels that are not in O(labels).
+        required: false
+        type: bool
+        default: false
+    tags:
+        description:
+            - Tags to add. Tags that do not exist are created.
+        required: false
+        type: list
+        elements: str
+        default: []
+    remove_tags:
+        description:
+            - Tags to remove.
+        required: false
+        type: list
+        elements: str
+        default: []
+    purge_tags:
+        description:
+            - Remove the tags that are not in O(tags).
+        required: false
+        type: bool
+        default: false
+    parallelism:
+        description:
+            - Maximum number of servers modified at the same time.
+        required: false
+        type: int
+        default: 10
+
+author:
+    - UpCloud (@UpCloudLtd)
+'''
+
+EXAMPLES = r'''
+- name: Label web servers for the new deployment
+  upcloud.cloud.server_labels:
+    servers: "{{ groups['web'] | map('extract', hostvars, 'id') }}"
+    labels:
+      release: "2024-05"
+    parallelism: 20
+
+- name: Move staging servers in Helsinki to maintenance
+  upcloud.cloud.server_labels:
+    filters:
+      zones:
+        - fi-hel2
+      labels:
+        - env=staging
+    tags:
+      - maintenance
+    remove_tags:
+      - production
+'''
+
+RETURN = r'''
+servers:
+    description:
+        - Labels and tags of the modified or matching servers after the changes.
+    returned: always
+    type: list
+    elements: dict
+    contains:
+        uuid:
+            description: UUID of the server.
+            type: str
+        hostname:
+            description: Hostname of the server.
+            type: str
+        labels:
+            description: Labels of the server.
+            type: dict
+        tags:
+            description: Tags of the server.
+            type: list
+            elements: str
+        changed:
+            description: Whether labels or tags of the server were changed.
+            type: bool
+'''
+
+from urllib.parse import quote
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.upcloud.cloud.plugins.module_utils.client import initialize_upcloud_client
+from ansible_collections.upcloud.cloud.plugins.module_utils.servers import (
+    list_servers, match_servers, resolve_servers, run_concurrently,
+)
+
+try:
+    from upcloud_api.errors import UpCloudAPIError
+except ImportError:
+    pass
+
+
+def _labels(server):
+    return {label['key']: label['value'] for label in (server.get('labels') or {}).get('label', [])}
+
+
+def _tags(server):
+    return list((server.get('tags') or {}).get('tag', []))
+
+
+class ServerLabels:
+    def __init__(self, names=None, filters=None, parallelism=10, client=None):
+        self.client = client or initialize_upcloud_client()
+        self.parallelism = parallelism
+
+        listing = list_servers(self.client)
+        if names is not None:
+            listing, unknown = resolve_servers(listing, names)
+            if unknown:
+                raise ValueError(f"Servers not found: {', '.join(unknown)}")
+
+        self.servers = match_servers(listing, **(filters or {}))
+        self.changes = {}
+
+    def plan(self, labels=None, remove_labels=(), purge_labels=False, tags=(), remove_tags=(), purge_tags=False):
+        """Compute the labels and tags of each server after the changes.
+
+        Returns {uuid: (labels or None, tags to add, tags to remove)} for the servers that need changes.
+        """
+        labels = labels or {}
+        wanted_tags = {tag.lower() for tag in tags}
+        unwanted_tags = {tag.lower() for tag in remove_tags} - wanted_tags
+
+        for server in self.servers:
+            current_labels = _labels(server)
+            new_labels = {} if purge_labels else dict(current_labels)
+            for key in remove_labels:
+                new_labels.pop(key, None)
+            new_labels.update(labels)
+
+            current_tags = _tags(server)
+            existing = {tag.lower() for tag in current_tags}
+            add_tags = [tag for tag in dict.fromkeys(tags) if tag.lower() not in existing]
+            untag = [
+                tag for tag in current_tags
+                if tag.lower() in unwanted_tags or (purge_tags and tag.lower() not in wanted_tags)
+            ]
+
+            if new_labels != current_labels or add_tags or untag:
+                self.changes[server['uuid']] = (new_labels if new_labels != current_labels else None, add_tags, untag)
+
+        return self.changes
+
+    def _create_missing_tags(self):
+        tags = {tag for dummy, add_tags, dummy in self.changes.values() for tag in add_tags}
+        if not tags:
+            return
+
+        existing = {tag['name'].lower() for tag in self.client.api.get_request('/tag')['tags']['tag']}
+        for tag in sorted(tags):
+            if tag.lower() not in existing:
+                self.client.api.post_request('/tag', {'tag': {'name': tag}})
+
+    def _modify(self, uuid):
+        labels, add_tags, remove_tags = self.changes[uuid]
+        if labels is not None:
+            body = {'server': {'labels': {'label': [{'key': key, 'value': value} for key, value in labels.items()]}}}
+            self.client.api.put_request(f'/server/{uuid}', body)
+        if add_tags:
+            self.client.api.post_request(f"/server/{uuid}/tag/{quote(','.join(add_tags), safe=',')}")
+        if remove_tags:
+            self.client.api.post_request(f"/server/{uuid}/untag/{quote(','.join(remove_tags), safe=',')}")
+
+    def apply(self):
+        """Send the planned changes concurrently, raises ValueError listing the servers that could not be modified."""
+        self._create_missing_tags()
+
+        errors = []
+        for uuid, dummy, error in run_concurrently(self._modify, list(self.changes), self.parallelism):
+            if error is not None:
+                errors.append(f"{uuid}: {error}")
+                del self.changes[uuid]
+
+        if errors:
+            raise ValueError(f"Failed to modify servers: {'; '.join(errors)}")
+
+    def result(self):
+        result = []
+        for server in self.servers:
+            labels = _labels(server)
+            tags = _tags(server)
+
+            change = self.changes.get(server['uuid'])
+            if change is not None:
+                new_labels, add_tags, remove_tags = change
+                if new_labels is not None:
+                    labels = new_labels
+                tags = [tag for tag in tags if tag not in remove_tags] + add_tags
+
+            result.append({
+                'uuid': server['uuid'],
+                'hostname': server['hostname'],
+                'labels': labels,
+                'tags': tags,
+                'changed': change is not None,
+            })
+
+        return result
+
+
+def main():
+    argument_spec = dict(
+        servers=dict(type='list', elements='str'),
+        filters=dict(type='dict', options=dict(
+            zones=dict(type='list', elements='str'),
+            states=dict(type='list', elements='str'),
+            tags=dict(type='list', elements='str'),
+            labels=dict(type='list', elements='str'),
+        )),
+        labels=dict(type='dict', default={}),
+        remove_labels=dict(type='list', elements='str', default=[]),
+        purge_labels=dict(type='bool', default=False),
+        tags=dict(type='list', elements='str', default=[]),
+        remove_tags=dict(type='list', elements='str', default=[]),
+        purge_tags=dict(type='bool', default=False),
+        parallelism=dict(type='int', default=10),
+    )
+
+    result = dict(
+        changed=False,
+        servers=[],
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_one_of=[('servers', 'filters')],
+        supports_check_mode=True,
+    )
+
+    try:
+        servers = ServerLabels(
+            module.params.get('servers'),
+            filters=module.params.get('filters'),
+            parallelism=module.params.get('parallelism'),
+        )
+        servers.plan(
+            labels={key: str(value) for key, value in module.params.get('labels').items()},
+            remove_labels=module.params.get('remove_labels'),
+            purge_labels=module.params.get('purge_labels'),
+            tags=module.params.get('tags'),
+            remove_tags=module.params.get('remove_tags'),
+            purge_tags=module.params.get('purge_tags'),
+        )
+    except (UpCloudAPIError, ValueError) as e:
+        module.fail_json(msg=str(e))
+
+    if not module.check_mode:
+        try:
+            servers.apply()
+        except (UpCloudAPIError, ValueError) as e:
+            result['servers'] = servers.result()
+            result['changed'] = bool(servers.changes)
+            module.fail_json(msg=str(e), **result)
+
+    result['servers'] = servers.result()
+    result['changed'] = bool(servers.changes)
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+__metaclass__ = type
+
+
+DOCUMENTATION = r'''
+---
+module: server_state
+version_added: "0.11.0"
+short_description: Start, stop or restart multiple UpCloud servers
+description:
+    - Change the power state of a list of UpCloud servers with one task.
+    - Start and stop requests are sent concurrently. Progress is followed by polling the server listing, so the number of
+      API requests while waiting depends on the number of poll rounds, not on the number of servers.
+options:
+    servers:
+        description:
+            - UUIDs or hostnames of the servers.
+        required: true
+        type: list
+        elements: str
+    state:
+        description:
+            - Wanted power state of the servers.
+            - V(restarted) stops the servers that are running and then starts all servers. Requires O(wait).
+        required: true
+        type: str
+        choices: [started, stopped, restarted]
+    stop_type:
+        description:
+            - Use V(soft) to request the operating system to shut down and V(hard) to stop the server immediately.
+        required: false
+        type: str
+        default: soft
+        choices: [soft, hard]
+    stop_timeout:
+        description:
+            - Seconds to wait for a soft shutdown before the server is stopped forcefully.
+        required: false
+        type: int
+        default: 60
+    parallelism:
+        description:
+            - Maximum number of start and stop requests in flight at the same time.
+        required: false
+        type: int
+        default: 10
+    wait:
+        description:
+            - Wait until all servers have reached the wanted state.
+        required: false
+        type: bool
+        default: true
+    wait_timeout:
+        description:
+            - Seconds to wait for the servers to reach the wanted state.
+        required: false
+        type: int
+        default: 600
+    poll_interval:
+        description:
+            - Seconds between server listing requests while waiting.
+        required: false
+        type: int
+        default: 5
+
+author:
+    - UpCloud (@UpCloudLtd)
+'''
+
+EXAMPLES = r'''
+- name: Stop staging servers for the night
+  upcloud.cloud.server_state:
+    servers: "{{ groups['staging'] | map('extract', hostvars, 'id') }}"
+    state: stopped
+    parallelism: 20
+
+- name: Restart servers by hostname
+  upcloud.cloud.server_state:
+    servers:
+      - web-1.example.com
+      - web-2.example.com
+    state: restarted
+'''
+
+RETURN = r'''
+servers:
+    description:
+        - State of the requested servers.
+    returned: always
+    type: list
+    elements: dict
+    contains:
+        uuid:
+            description: UUID of the server.
+            type: str
+        hostname:
+            description: Hostname of the server.
+            type: str
+        state:
+            description: Last known state of the server.
+            type: str
+        changed:
+            description: Whether start or stop was requested for the server.
+            type: bool
+'''
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.upcloud.cloud.plugins.module_utils.client import initialize_upcloud_client
+from ansible_collections.upcloud.cloud.plugins.module_utils.servers import list_servers, resolve_servers, run_concurrently
+
+try:
+    from upcloud_api.errors import UpCloudAPIError
+except ImportError:
+    pass
+
+
+# Server states in which a start or stop request moves the server towards the wanted state
+ACTIONABLE_STATES = {
+    'started': 'stopped',
+    'stopped': 'started',
+}
+
+
+class ServerStateTimeout(Exception):
+    pass
+
+
+class ServerState:
+    def __init__(self, names, stop_type='soft', stop_timeout=60, parallelism=10, poll_interval=5, client=None):
+        self.client = client or initialize_upcloud_client()
+
+        self.stop_type = stop_type
+        self.stop_timeout = stop_timeout
+        self.parallelism = parallelism
+        self.poll_interval = poll_interval
+
+        servers, unknown = resolve_servers(list_servers(self.client), names)
+        if unknown:
+            raise ValueError(f"Servers not found: {', '.join(unknown)}")
+
+        self.servers = servers
+        self.states = {server['uuid']: server['state'] for server in servers}
+        self.changed = set()
+
+    def _start(self, uuid):
+        return self.client.api.post_request(f'/server/{uuid}/start')
+
+    def _stop(self, uuid):
+        body = {
+            'stop_server': {
+                'stop_type': self.stop_type,
+                'timeout': str(self.stop_timeout),
+            }
+        }
+        return self.client.api.post_request(f'/server/{uuid}/stop', body)
+
+    def _refresh(self):
+        for server in list_servers(self.client):
+            if server['uuid'] in self.states:
+                self.states[server['uuid']] = server['state']
+
+    def pending(self, target, uuids=None):
+        return [uuid for uuid in (self.states if uuids is None else uuids) if self.states[uuid] != target]
+
+    def request(self, target, uuids=None, check_mode=False):
+        """Send start or stop requests to the servers that are in a state from which they can be moved to target.
+
+        Returns UUIDs of the servers the request was sent to.
+        """
+        action = self._start if target == 'started' else self._stop
+        uuids = [uuid for uuid in (self.states if uuids is None else uuids) if self.states[uuid] == ACTIONABLE_STATES[target]]
+
+        if check_mode:
+            self.changed.update(uuids)
+            return uuids
+
+        errors = []
+        for uuid, dummy, error in run_concurrently(action, uuids, self.parallelism):
+            if error is not None:
+                errors.append(f"{uuid}: {error}")
+            else:
+                self.changed.add(uuid)
+
+        if errors:
+            raise ValueError(f"Failed to change state of servers: {'; '.join(errors)}")
+
+        return uuids
+
+    def wait(self, target, timeout, uuids=None):
+        """Poll the server listing until the servers have reached the target state.
+
+        Servers that are in maintenance when the wait starts, are sent the request once they settle.
+        """
+        deadline = time.monotonic() + timeout
+        uuids = list(self.states if uuids is None else uuids)
+        requested = set()
+
+        while True:
+            requested.update(self.request(target, [uuid for uuid in self.pending(target, uuids) if uuid not in requested]))
+
+            pending = self.pending(target, uuids)
+            if not pending:
+                return
+
+            if time.monotonic() >= deadline:
+                raise ServerStateTimeout(
+                    f"Timeout waiting for servers to reach state {target}: {', '.join(pending)}")
+
+            time.sleep(self.poll_interval)
+            self._refresh()
+
+    def result(self):
+        return [
+            {
+                'uuid': server['uuid'],
+                'hostname': server['hostname'],
+                'state': self.states[server['uuid']],
+                'changed': server['uuid'] in self.changed,
+            }
+            for server in self.servers
+        ]
+
+
+def main():
+    argument_spec = dict(
+        servers=dict(type='list', elements='str', required=True),
+        state=dict(type='str', required=True, choices=['started', 'stopped', 'restarted']),
+        stop_type=dict(type='str', default='soft', choices=['soft', 'hard']),
+        stop_timeout=dict(type='int', default=60),
+        parallelism=dict(type='int', default=10),
+        wait=dict(type='bool', default=True),
+        wait_timeout=dict(type='int', default=600),
+        poll_interval=dict(type='int', default=5),
+    )
+
+    result = dict(
+        changed=False,
+        servers=[],
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
+
+    state = module.params.get('state')
+    wait = module.params.get('wait')
+    if state == 'restarted' and not wait:
+        module.fail_json(msg='state=restarted requires wait=true.')
+
+    try:
+        servers = ServerState(
+            module.params.get('servers'),
+            stop_type=module.params.get('stop_type'),
+            stop_timeout=module.params.get('stop_timeout'),
+            parallelism=module.params.get('parallelism'),
+            poll_interval=module.params.get('poll_interval'),
+        )
+    except (UpCloudAPIError, ValueError) as e:
+        module.fail_json(msg=str(e))
+
+    try:
+        if module.check_mode:
+            if state == 'restarted':
+                servers.changed.update(servers.states)
+            else:
+                servers.request(state, check_mode=True)
+        elif state == 'restarted':
+            deadline = time.monotonic() + module.params.get('wait_timeout')
+            running = [uuid for uuid, server_state in servers.states.items() if server_state != 'stopped']
+            servers.wait('stopped', deadline - time.monotonic(), running)
+            servers.wait('started', max(0, deadline - time.monotonic()))
+        elif wait:
+            servers.wait(state, module.params.get('wait_timeout'))
+        else:
+            servers.request(state)
+    except (UpCloudAPIError, ValueError, ServerStateTimeout) as e:
+        result['servers'] = servers.result()
+        module.fail_json(msg=str(e), **result)
+
+    result['servers'] = servers.result()
+    result['changed'] = bool(servers.changed)
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Keep the inventory cache of upcloud.cloud.servers inventory sources warm.
+
+Refreshes the cached servers of each inventory source when they are older than the refresh interval, so that
+Ansible runs read a warm cache instead of fetching the servers from the API. The inventory sources must enable
+caching with a persistent cache plugin, for example ``ansible.builtin.jsonfile``, and ``cache_timeout`` should be
+longer than the refresh interval.
+
+Refreshes fetch the server listing and details of new or changed servers only, details of the other servers are
+reused from the cache. Details of all servers are refetched every ``--full-refresh-interval`` seconds.
+
+Run the script from the installed collection::
+
+    python ~/.ansible/collections/ansible_collections/upcloud/cloud/plugins/plugin_utils/inventory_cache_warmer.py \\
+        -i inventory.upcloud.yml --interval 300
+"""
+
+import argparse
+import sys
+import time
+
+from ansible.errors import AnsibleError
+from ansible.inventory.data import InventoryData
+from ansible.parsing.dataloader import DataLoader
+from ansible.plugins.loader import init_plugin_loader, inventory_loader
+from ansible.utils.display import Display
+from ansible.utils.path import unfrackpath
+
+display = Display()
+
+PLUGIN_NAME = "upcloud.cloud.servers"
+
+
+def _plugin():
+    return inventory_loader.get(PLUGIN_NAME)
+
+
+def refresh(loader, path, full=False):
+    snapshot = _plugin().refresh_cache(InventoryData(), loader, path, full=full)
+    display.display(f"Refreshed {len(snapshot['servers'])} servers of {path}")
+
+
+def run(paths, interval, full_refresh_interval, once=False):
+    loader = DataLoader()
+
+    while True:
+        next_due = interval
+        for path in paths:
+            snapshot = _plugin().cached_snapshot(loader, path)
+            age = time.time() - snapshot["fetched_at"] if snapshot else None
+
+            if once or age is None or age >= interval:
+                full = snapshot is None or time.time() - snapshot["full_fetched_at"] >= full_refresh_interval
+                try:
+                    refresh(loader, path, full=full)
+                except AnsibleError as e:
+                    display.warning(f"Failed to refresh {path}: {e}")
+            else:
+                next_due = min(next_due, interval - age)
+
+        if once:
+            return
+
+        time.sleep(max(1, next_due))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the inventory cache of UpCloud inventory sources warm.")
+    parser.add_argument("-i", "--inventory", action="append", required=True, help="upcloud.yml inventory source")
+    parser.add_argument("--interval", type=int, default=300, help="refresh servers older than this many seconds")
+    parser.add_argument(
+        "--full-refresh-interval", type=int, default=3600, help="refetch details of all servers this often (seconds)")
+    parser.add_argument("--once", action="store_true", help="refresh all sources once and exit")
+    args = parser.parse_args(argv)
+
+    init_plugin_loader()
+    paths = [unfrackpath(path, follow=False) for path in args.inventory]
+
+    try:
+        run(paths, args.interval, args.full_refresh_interval, once=args.once)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
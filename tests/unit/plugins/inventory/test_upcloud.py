@@ -1,10 +1,20 @@
 __metaclass__ = type
 
+import threading
+
 import pytest
 
 from ansible.inventory.data import InventoryData
+from ansible.parsing.dataloader import DataLoader
+from .....plugins.inventory import servers
 from .....plugins.inventory.servers import InventoryModule
 
+try:
+    from ansible.template import trust_as_template
+except ImportError:
+    def trust_as_template(value):
+        return value
+
 
 class Server:
     """
@@ -521,3 +531,529 @@ def test_connect_with_fallback(inventory, mocker):
 
     assert host1.vars['ansible_host'] == "1.1.1.10"
     assert host3.vars['ansible_host'] == "172.16.0.3"
+
+
+def get_zone_option(option):
+    options = {
+        'plugin': 'upcloud.cloud.servers',
+        'connect_with': 'public_ipv4',
+        'zones': ['nl-ams1'],
+    }
+    return options.get(option)
+
+
+def test_shared_servers_between_sources(mocker):
+    servers._SHARED_SERVERS.clear()
+    fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+
+    def _mock_initialize_shared_client(self):
+        self._shared_key = 'account'
+
+    results = []
+    for get_option_func in (get_option, get_zone_option):
+        source = InventoryModule()
+        source.inventory = InventoryData()
+        source._fetch_servers = fetch_servers
+        source._fetch_server_details = fetch_server_details
+        source.get_option = mocker.MagicMock(side_effect=get_option_func)
+        source._initialize_upcloud_client = _mock_initialize_shared_client.__get__(source)
+
+        source._populate()
+        results.append(source.inventory)
+
+    assert fetch_servers.call_count == 1
+    assert fetch_server_details.call_count == 3
+    assert len(results[0].hosts) == 2
+    assert list(results[1].hosts) == ['server2']
+
+
+def test_snapshot_reuses_details_of_unchanged_servers(inventory, mocker):
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory.get_option = mocker.MagicMock(side_effect=get_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    inventory._populate()
+    snapshot = inventory._make_snapshot()
+
+    assert len(snapshot["servers"]) == 3
+    assert snapshot["full_fetched_at"] == snapshot["fetched_at"]
+
+    # Use the snapshot instead of the API
+    cached = InventoryModule()
+    cached.inventory = InventoryData()
+    cached.get_option = mocker.MagicMock(side_effect=get_option)
+    cached._initialize_upcloud_client = mocker.MagicMock()
+    cached._cached_snapshot = snapshot
+
+    cached._populate()
+
+    assert cached._initialize_upcloud_client.call_count == 0
+    assert sorted(cached.inventory.hosts) == sorted(inventory.inventory.hosts)
+    assert cached.inventory.get_host('server1').vars['ansible_host'] == "1.1.1.10"
+
+    # Incremental refresh fetches details only for servers whose listing data has changed
+    listing = get_servers()
+    listing[0].state = "stopped"
+
+    refreshed = InventoryModule()
+    refreshed.inventory = InventoryData()
+    refreshed._fetch_servers = mocker.MagicMock(return_value=listing)
+    refreshed._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    refreshed.get_option = mocker.MagicMock(side_effect=get_option)
+    refreshed._initialize_upcloud_client = _mock_initialize_client
+    refreshed._previous_snapshot = snapshot
+
+    refreshed._populate()
+
+    refreshed._fetch_server_details.assert_called_once_with(listing[0].uuid)
+    assert refreshed.inventory.get_host('server1').vars['state'] == "stopped"
+    assert refreshed._make_snapshot()["full_fetched_at"] == snapshot["full_fetched_at"]
+
+
+def get_server_details_failing_for_server1(uuid):
+    if uuid == '00229adf-0e46-49b5-a8f7-cbd638d11f6a':
+        raise servers.UpCloudAPIError(error_code='TIMEOUT', error_message='Request timed out')
+    return get_server_details(uuid)
+
+
+@pytest.mark.parametrize('degraded_servers', ['add', 'skip'])
+def test_degraded_servers(inventory, mocker, degraded_servers):
+    def get_degraded_option(option):
+        options = {
+            'plugin': 'upcloud.cloud.servers',
+            'connect_with': ['public_ipv4', 'hostname'],
+            'degraded_servers': degraded_servers,
+        }
+        return options.get(option)
+
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details_failing_for_server1)
+    inventory.get_option = mocker.MagicMock(side_effect=get_degraded_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+    warning = mocker.patch.object(servers.display, 'warning')
+
+    inventory._populate()
+
+    assert warning.call_count == 1
+    assert 'server1' in warning.call_args[0][0]
+    assert inventory.inventory.get_host('server2').vars['ansible_host'] == "1.1.1.12"
+
+    host1 = inventory.inventory.get_host('server1')
+    if degraded_servers == 'skip':
+        assert host1 is None
+        assert 'upcloud_degraded' not in inventory.inventory.groups
+    else:
+        assert host1.vars['state'] == "started"
+        assert host1.vars['tags'] == ['foo', 'bar']
+        assert host1.vars['ansible_host'] == "server1"
+        assert 'firewall' not in host1.vars
+        assert [h.name for h in inventory.inventory.groups['upcloud_degraded'].get_hosts()] == ['server1']
+
+
+def test_timeout_degrades_remaining_servers(inventory, mocker):
+    def get_timeout_option(option):
+        options = {
+            'plugin': 'upcloud.cloud.servers',
+            'connect_with': 'public_ipv4',
+            'timeout': 10,
+            'request_timeout': 30,
+        }
+        return options.get(option)
+
+    def fetch_slowly(uuid):
+        timeouts.append(inventory.client.api.timeout_override.call_args[0][0])
+        clock.return_value += 6
+        return get_server_details(uuid)
+
+    timeouts = []
+    clock = mocker.patch.object(servers.time, 'monotonic', return_value=1000.0)
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=fetch_slowly)
+    inventory.get_option = mocker.MagicMock(side_effect=get_timeout_option)
+    inventory.client = mocker.MagicMock()
+    inventory._initialize_upcloud_client = _mock_initialize_client
+    mocker.patch.object(servers.display, 'warning')
+
+    inventory._populate()
+
+    assert timeouts == [10, 4]
+    assert inventory._fetch_server_details.call_count == 2
+    assert list(inventory._degraded.values()) == ["inventory timeout reached"]
+    assert len(inventory.inventory.groups['upcloud_degraded'].get_hosts()) == 1
+
+
+def test_group_by(inventory, mocker):
+    def get_group_by_option(option):
+        options = {
+            'plugin': 'upcloud.cloud.servers',
+            'connect_with': 'public_ipv4',
+            'group_by': ['zone', 'tags', 'labels', 'label_keys', 'server_group'],
+        }
+        return options.get(option)
+
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory.get_option = mocker.MagicMock(side_effect=get_group_by_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    inventory._populate()
+
+    def group_hosts(name):
+        group = inventory.inventory.groups[inventory._sanitize_group_name(name)]
+        return sorted(host.name for host in group.get_hosts())
+
+    assert group_hosts('upcloud_zone_de-fra1') == ['server1']
+    assert group_hosts('upcloud_zone_nl-ams1') == ['server2']
+    assert group_hosts('upcloud_tag_foo') == ['server1']
+    assert group_hosts('upcloud_label_foo=bar') == ['server2']
+    assert group_hosts('upcloud_label_key_foo') == ['server2']
+    assert not any(name.startswith('upcloud_server_group') for name in inventory.inventory.groups)
+
+
+def get_constructed_option(option):
+    options = {
+        'plugin': 'upcloud.cloud.servers',
+        'connect_with': ['public_ipv4', 'hostname'],
+        'strict': True,
+        'group_by': ['zone', 'tags'],
+        'compose': {
+            'ansible_user': trust_as_template("'root' if state == 'started' else 'admin'"),
+            'plan_upper': trust_as_template('plan | upper'),
+        },
+        'groups': {
+            'running': trust_as_template("state == 'started'"),
+        },
+        'keyed_groups': [
+            {'key': trust_as_template('plan'), 'prefix': 'plan', 'parent_group': 'plans'},
+        ],
+    }
+    return options.get(option)
+
+
+def _build_constructed_inventory(mocker, construct_processes):
+    def get_option(option):
+        if option == 'construct_processes':
+            return construct_processes
+        return get_constructed_option(option)
+
+    source = InventoryModule()
+    source.inventory = InventoryData()
+    source.loader = DataLoader()
+    source._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    source._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    source.get_option = mocker.MagicMock(side_effect=get_option)
+    source._initialize_upcloud_client = _mock_initialize_client
+
+    source._populate()
+
+    return {
+        'groups': [
+            (name, sorted(host.name for host in group.get_hosts()), [child.name for child in group.child_groups])
+            for name, group in source.inventory.groups.items()
+        ],
+        'hosts': [(name, dict(host.vars), [group.name for group in host.groups]) for name, host in source.inventory.hosts.items()],
+    }
+
+
+def test_construct_processes_match_serial(mocker):
+    serial = _build_constructed_inventory(mocker, 0)
+    parallel = _build_constructed_inventory(mocker, 2)
+
+    assert parallel == serial
+
+    groups = {name: hosts for name, hosts, dummy in serial['groups']}
+    hostvars = {name: hostvars for name, hostvars, dummy in serial['hosts']}
+    assert groups['running'] == ['server1', 'server3']
+    assert hostvars['server2']['ansible_user'] == 'admin'
+    assert hostvars['server2']['plan_upper'] == '1XCPU-2GB'
+
+
+def test_shards_are_disjoint_and_stable(inventory, mocker):
+    uuids = [f'00000000-0000-4000-8000-{i:012d}' for i in range(300)]
+
+    shards = {uuid: servers._shard(uuid, 3) for uuid in uuids}
+    assert set(shards.values()) == {0, 1, 2}
+
+    # Adding a shard only moves servers to the new shard
+    for uuid in uuids:
+        shard = servers._shard(uuid, 4)
+        assert shard in (shards[uuid], 3)
+
+    def get_shard_option(index):
+        def get_option(option):
+            options = {
+                'plugin': 'upcloud.cloud.servers',
+                'connect_with': 'hostname',
+                'shard_count': 2,
+                'shard_index': index,
+            }
+            return options.get(option)
+        return get_option
+
+    hosts = []
+    for index in range(2):
+        source = InventoryModule()
+        source.inventory = InventoryData()
+        source._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+        source._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+        source.get_option = mocker.MagicMock(side_effect=get_shard_option(index))
+        source._initialize_upcloud_client = _mock_initialize_client
+
+        source._populate()
+
+        assert source._fetch_server_details.call_count == len(source.inventory.hosts)
+        hosts.append(set(source.inventory.hosts))
+
+    assert not hosts[0] & hosts[1]
+    assert hosts[0] | hosts[1] == {'server1', 'server2', 'server3'}
+
+
+def test_concurrent_requests(inventory, mocker):
+    def get_concurrent_option(option):
+        options = {
+            'plugin': 'upcloud.cloud.servers',
+            'connect_with': 'private_ipv4',
+            'network': '035146a5-7a85-408b-b1f8-21925164a7d3',
+            'zones': ['de-fra1', 'nl-ams1'],
+            'concurrency': 4,
+        }
+        return options.get(option)
+
+    listed = threading.Event()
+
+    def fetch_network_details(uuid):
+        # The network is requested at the same time as the server listing
+        assert listed.wait(5)
+        return get_network_details(uuid)
+
+    def fetch_servers():
+        listed.set()
+        return get_servers()
+
+    inventory._fetch_servers = mocker.MagicMock(side_effect=fetch_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory._fetch_network_details = mocker.MagicMock(side_effect=fetch_network_details)
+    inventory.get_option = mocker.MagicMock(side_effect=get_concurrent_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    inventory._populate()
+
+    assert sorted(inventory.inventory.hosts) == ['server1', 'server3']
+    assert inventory.inventory.get_host('server3').vars['ansible_host'] == "172.16.0.3"
+    # Details are fetched for all servers that passed the zone filter, also server2 that is not in the network
+    assert inventory._fetch_server_details.call_count == 3
+    assert inventory._executor is None
+
+
+def get_loadbalancers():
+    return [
+        {
+            'uuid': '0aded5c1-c7a3-498a-b9c8-a871611c47a2',
+            'name': 'web-lb',
+            'backends': [
+                {
+                    'name': 'main',
+                    'members': [
+                        {'name': 'member_1', 'ip': '172.16.0.4', 'port': 80, 'weight': 100, 'enabled': True},
+                        {'name': 'member_2', 'ip': '1.1.1.12', 'port': 80, 'weight': 0, 'enabled': True},
+                        {'name': 'member_3', 'ip': '10.0.0.1', 'port': 80, 'weight': 100, 'enabled': True},
+                    ],
+                },
+            ],
+        },
+    ]
+
+
+def test_include_loadbalancers(inventory, mocker):
+    def get_loadbalancer_option(option):
+        options = {
+            'plugin': 'upcloud.cloud.servers',
+            'connect_with': 'public_ipv4',
+            'include_loadbalancers': True,
+        }
+        return options.get(option)
+
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory._fetch_loadbalancers = mocker.MagicMock(side_effect=get_loadbalancers)
+    inventory.get_option = mocker.MagicMock(side_effect=get_loadbalancer_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    inventory._populate()
+
+    assert inventory._fetch_loadbalancers.call_count == 1
+
+    memberships = inventory.inventory.get_host('server1').vars['upcloud_lb_memberships']
+    assert [(i['loadbalancer_name'], i['backend'], i['member'], i['ip_address']) for i in memberships] == [
+        ('web-lb', 'main', 'member_1', '172.16.0.4'),
+    ]
+    assert inventory.inventory.get_host('server2').vars['upcloud_lb_memberships'][0]['weight'] == 0
+
+    group = inventory.inventory.groups[inventory._sanitize_group_name('upcloud_lb_web-lb_main')]
+    assert sorted(host.name for host in group.get_hosts()) == ['server1', 'server2']
+
+    # Memberships are restored from the inventory cache
+    cached = InventoryModule()
+    cached.inventory = InventoryData()
+    cached.get_option = mocker.MagicMock(side_effect=get_loadbalancer_option)
+    cached._cached_snapshot = inventory._make_snapshot()
+
+    cached._populate()
+
+    assert cached.inventory.get_host('server1').vars['upcloud_lb_memberships'] == memberships
+
+
+def test_facts(inventory, mocker):
+    def get_facts_option(option):
+        options = {
+            'plugin': 'upcloud.cloud.servers',
+            'connect_with': 'public_ipv4',
+            'facts': True,
+        }
+        return options.get(option)
+
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory.get_option = mocker.MagicMock(side_effect=get_facts_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    inventory._populate()
+
+    host1 = inventory.inventory.get_host('server1')
+    assert host1.vars['ansible_processor_vcpus'] == 2
+    assert host1.vars['ansible_memtotal_mb'] == 4096
+    assert host1.vars['ansible_all_ipv4_addresses'][0] == '1.1.1.10'
+    assert host1.vars['ansible_all_ipv6_addresses'] == []
+
+
+def get_probe_option(option):
+    options = {
+        'plugin': 'upcloud.cloud.servers',
+        'connect_with': ['public_ipv4', 'hostname'],
+        'probe_connection': True,
+        'probe_port': 22,
+        'probe_timeout': 1,
+        'probe_concurrency': 10,
+        'probe_cache_ttl': 600,
+    }
+    return options.get(option)
+
+
+def test_probe_connection(inventory, mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv('UPCLOUD_CACHE_DIR', str(tmp_path))
+    reachable = mocker.patch.object(servers, '_is_reachable', side_effect=lambda address, port, timeout: address == 'server1')
+
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory.get_option = mocker.MagicMock(side_effect=get_probe_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    inventory._populate()
+
+    # Unreachable public addresses fall back to hostname, stopped servers are not probed
+    assert inventory.inventory.get_host('server1').vars['ansible_host'] == 'server1'
+    assert inventory.inventory.get_host('server2').vars['ansible_host'] == '1.1.1.12'
+    probed = {call.args[0] for call in reachable.call_args_list}
+    assert '1.1.1.10' in probed and 'server1' in probed
+    assert '1.1.1.12' not in probed
+
+    # Chosen addresses are reused from the cache
+    reachable.reset_mock()
+    inventory.inventory = InventoryData()
+    inventory._populate()
+
+    assert inventory.inventory.get_host('server1').vars['ansible_host'] == 'server1'
+    assert 'server1' not in {call.args[0] for call in reachable.call_args_list}
+
+
+def test_batches_limit_hosts_per_zone_and_backend(inventory):
+    def host(index, zone, backend=None):
+        attributes = [{'key': 'zone', 'attribute': zone}, {'key': 'server_group', 'attribute': ''}]
+        if backend:
+            memberships = [{'loadbalancer': 'lb', 'backend': backend}]
+            attributes.append({'key': 'upcloud_lb_memberships', 'attribute': memberships})
+        return f'host{index:02}', attributes, False
+
+    hosts = [host(i, 'de-fra1', 'web' if i < 4 else None) for i in range(8)] + [host(i, 'fi-hel2') for i in range(8, 12)]
+
+    batched = inventory._assign_batches(hosts, 4, 0.25)
+    batches = {hostname: attributes[-1]['attribute'] for hostname, attributes, dummy in batched}
+
+    assert [attributes[-1]['key'] for dummy, attributes, dummy in batched] == ['upcloud_batch'] * 12
+    for batch in set(batches.values()):
+        members = [i for i in range(12) if batches[f'host{i:02}'] == batch]
+        assert len(members) <= 3
+        assert len([i for i in members if i < 8]) <= 2
+        assert len([i for i in members if i >= 8]) <= 1
+        assert len([i for i in members if i < 4]) <= 1
+    assert max(batches.values()) == 4
+
+
+def test_batch_groups(inventory, mocker):
+    def get_batch_option(option):
+        options = {
+            'plugin': 'upcloud.cloud.servers',
+            'connect_with': 'public_ipv4',
+            'batch_size': 2,
+            'batch_max_fraction': 0.5,
+        }
+        return options.get(option)
+
+    inventory._fetch_servers = mocker.MagicMock(side_effect=get_servers)
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory.get_option = mocker.MagicMock(side_effect=get_batch_option)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    inventory._populate()
+
+    hosts = inventory.inventory.groups['upcloud'].get_hosts()
+    batches = {host.name: host.vars['upcloud_batch'] for host in hosts}
+    assert sorted(batches.values())[0] == 1
+    for hostname, batch in batches.items():
+        assert hostname in [host.name for host in inventory.inventory.groups[f'upcloud_batch_{batch}'].get_hosts()]
+
+
+def test_change_groups(inventory, mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv('UPCLOUD_CACHE_DIR', str(tmp_path))
+    options = {
+        'plugin': 'upcloud.cloud.servers',
+        'connect_with': 'public_ipv4',
+        'change_groups': True,
+        'update_change_baseline': True,
+    }
+    listing = get_servers()
+
+    inventory._fetch_server_details = mocker.MagicMock(side_effect=get_server_details)
+    inventory.get_option = mocker.MagicMock(side_effect=options.get)
+    inventory._initialize_upcloud_client = _mock_initialize_client
+
+    def build():
+        inventory.inventory = InventoryData()
+        inventory._fetch_servers = mocker.MagicMock(return_value=list(listing))
+        inventory._populate()
+        inventory._add_change_groups('/inventory/upcloud.yml')
+        return {
+            group: sorted(host.name for host in inventory.inventory.groups[group].get_hosts())
+            for group in ('upcloud_added', 'upcloud_changed', 'upcloud_unchanged')
+        }
+
+    first = build()
+    assert first['upcloud_changed'] == first['upcloud_unchanged'] == []
+    hostnames = first['upcloud_added']
+
+    assert hostnames == ['server1', 'server2']
+
+    [server for server in listing if server.hostname == 'server1'][0].state = 'maintenance'
+    removed = [server for server in listing if server.hostname == 'server2'][0]
+    listing.remove(removed)
+    second = build()
+    assert second == {'upcloud_added': [], 'upcloud_changed': ['server1'], 'upcloud_unchanged': []}
+
+    # Without updating the baseline, the same changes are reported again
+    options['update_change_baseline'] = False
+    listing.append(removed)
+    third = build()
+    assert third == {'upcloud_added': ['server2'], 'upcloud_changed': [], 'upcloud_unchanged': ['server1']}
+    assert build() == third
@@ -0,0 +1,55 @@
+__metaclass__ = type
+
+import pytest
+
+from ansible.plugins.loader import lookup_loader
+from .....plugins.lookup import loadbalancer
+
+
+def get_loadbalancer(uuid):
+    return {
+        'uuid': uuid,
+        'name': 'web-lb',
+        'backends': [
+            {
+                'name': 'main',
+                'members': [
+                    {'name': 'member_0', 'ip': '10.100.1.2', 'port': 80, 'weight': 100, 'enabled': True},
+                    {'name': 'member_1', 'ip': '10.100.1.3', 'port': 80, 'weight': 100, 'enabled': True},
+                ],
+            },
+        ],
+    }
+
+
+@pytest.fixture()
+def lookup(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv('UPCLOUD_CACHE_DIR', str(tmp_path))
+    mocker.patch.object(loadbalancer, 'client_cache_key', return_value='account')
+    loadbalancer._LOADBALANCERS.clear()
+
+    r = lookup_loader.get('upcloud.cloud.loadbalancer')
+    r._fetch_loadbalancer = mocker.MagicMock(side_effect=get_loadbalancer)
+    return r
+
+
+def test_lookup_by_ip_address(lookup):
+    result = lookup.run(['lb-uuid'], ip_address='10.100.1.3')
+
+    assert len(result) == 1
+    assert result[0]['backend'] == 'main'
+    assert result[0]['member'] == 'member_1'
+
+
+def test_lookup_is_cached(lookup):
+    lookup.run(['lb-uuid'], member_name='member_0')
+    lookup.run(['lb-uuid'], member_name='member_1')
+    assert lookup._fetch_loadbalancer.call_count == 1
+
+    # Other processes read the load balancer from the disk cache
+    loadbalancer._LOADBALANCERS.clear()
+    assert len(lookup.run(['lb-uuid'])) == 2
+    assert lookup._fetch_loadbalancer.call_count == 1
+
+    lookup.run(['lb-uuid'], refresh=True)
+    assert lookup._fetch_loadbalancer.call_count == 2
@@ -0,0 +1,141 @@
+__metaclass__ = type
+
+import threading
+
+import pytest
+
+from .....plugins.module_utils import ratelimit
+from .....plugins.module_utils.api import UpCloudAPI
+
+
+class CountingAPI(UpCloudAPI):
+    def __init__(self, delay=None):
+        super().__init__('Basic dGVzdDp0ZXN0', None)
+        self.calls = []
+        self.timeouts = []
+        self.delay = delay
+
+    def _send(self, method, endpoint, body, params, timeout):
+        self.calls.append((method, endpoint))
+        self.timeouts.append(timeout)
+        if self.delay is not None:
+            self.delay.wait(5)
+        if endpoint == '/missing':
+            return 404, {'error': {'error_code': 'NOT_FOUND', 'error_message': 'Not found'}}
+        return 200, {'server': {'uuid': endpoint, 'ip_addresses': ['1.1.1.1']}}
+
+
+def test_concurrent_gets_share_one_request():
+    release = threading.Event()
+    api = CountingAPI(delay=release)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(api.get_request('/network/uuid'))) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 5
+    assert api.calls == [('GET', '/network/uuid')]
+
+
+def test_responses_are_remembered_and_copied():
+    api = CountingAPI()
+
+    first = api.get_request('/server/uuid')
+    first['server'].pop('ip_addresses')
+    second = api.get_request('/server/uuid')
+
+    assert second['server']['ip_addresses'] == ['1.1.1.1']
+    assert len(api.calls) == 1
+
+    api.get_request('/server/uuid', params={'limit': 10})
+    assert len(api.calls) == 2
+
+
+def test_changes_clear_remembered_responses():
+    api = CountingAPI()
+
+    api.get_request('/server/uuid')
+    api.put_request('/server/uuid', {'server': {}})
+    api.get_request('/server/uuid')
+
+    assert api.calls == [('GET', '/server/uuid'), ('PUT', '/server/uuid'), ('GET', '/server/uuid')]
+
+
+def test_errors_are_not_remembered():
+    from upcloud_api.errors import UpCloudAPIError
+
+    api = CountingAPI()
+
+    for i in range(2):
+        with pytest.raises(UpCloudAPIError):
+            api.get_request('/missing')
+
+    assert len(api.calls) == 2
+
+
+def test_memo_can_be_disabled(monkeypatch):
+    monkeypatch.setenv('UPCLOUD_API_MEMO_TTL', '0')
+    api = CountingAPI()
+
+    api.get_request('/server/uuid')
+    api.get_request('/server/uuid')
+
+    assert len(api.calls) == 2
+
+
+def test_timeout_override_applies_to_current_thread():
+    api = CountingAPI()
+    api.timeout = 60
+
+    with api.timeout_override(5):
+        api.put_request('/server/uuid', {'server': {}})
+        thread = threading.Thread(target=lambda: api.put_request('/server/uuid', {'server': {}}))
+        thread.start()
+        thread.join(5)
+        api.put_request('/server/uuid', {'server': {}}, timeout=1)
+    api.put_request('/server/uuid', {'server': {}})
+
+    assert api.timeouts == [5, 60, 1, 60]
+
+
+def test_send_requests_compression_and_decodes_bytes(mocker):
+    api = UpCloudAPI('Basic dGVzdDp0ZXN0', None)
+    response = mocker.MagicMock(status_code=200, content='{"servers": {"server": [{"title": "päivä"}]}}'.encode())
+    request = mocker.patch.object(api.session, 'request', return_value=response)
+
+    assert api.get_request('/server') == {'servers': {'server': [{'title': 'päivä'}]}}
+    assert 'gzip' in api.session.headers['Accept-Encoding']
+    assert request.call_count == 1
+
+    response.content = b''
+    assert api.delete_request('/server/uuid') == {}
+
+
+def test_forked_process_gets_own_connections():
+    api = CountingAPI()
+    api.get_request('/server/uuid')
+    session = api.session
+
+    # As seen by a process forked after the client was created
+    api._pid = -1
+    api.get_request('/server/uuid')
+
+    assert api.session is not session
+    assert len(api.calls) == 2
+
+
+def test_throttled_requests_are_retried(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv('UPCLOUD_CACHE_DIR', str(tmp_path))
+    sleep = mocker.patch.object(ratelimit, 'time', mocker.MagicMock(time=lambda: 1000.0)).sleep
+    api = UpCloudAPI('Basic dGVzdDp0ZXN0', None)
+    throttled = mocker.MagicMock(status_code=429, content=b'{}', headers={'Retry-After': '2'})
+    response = mocker.MagicMock(status_code=200, content=b'{"account": {}}', headers={})
+    request = mocker.patch.object(api.session, 'request', side_effect=[throttled, response])
+
+    assert api.get_request('/account') == {'account': {}}
+    assert request.call_count == 2
+    assert sum(call.args[0] for call in sleep.call_args_list) == pytest.approx(2, abs=0.5)
@@ -0,0 +1,95 @@
+__metaclass__ = type
+
+import pytest
+
+from .....plugins.module_utils.loadbalancer import LoadBalancerBackend, LoadBalancerTopology, update_backend_members
+
+
+def get_members():
+    return [
+        {'name': 'member_0', 'ip': '10.100.1.2', 'weight': 100},
+        {'name': 'member_1', 'ip': '10.100.1.3', 'weight': 0},
+        {'name': 'member_2', 'ip': '10.100.1.4', 'weight': 100},
+    ]
+
+
+def get_loadbalancer():
+    return {
+        'uuid': 'lb-uuid',
+        'name': 'web-lb',
+        'backends': [
+            {'name': 'main', 'members': get_members()},
+            {'name': 'canary', 'members': [{'name': 'member_0', 'ip': '10.100.1.5', 'weight': 10}]},
+        ],
+    }
+
+
+@pytest.fixture()
+def client(mocker):
+    client = mocker.MagicMock()
+    client.api.get_request = mocker.MagicMock(side_effect=lambda url: get_members())
+    client.api.patch_request = mocker.MagicMock(side_effect=lambda url, body: body)
+    return client
+
+
+def test_backend_set_weight_reads_once(client):
+    backend = LoadBalancerBackend('lb-uuid', 'main', client=client)
+    backend.read()
+
+    changed, details = backend.set_weight([{'member_name': 'member_0'}, {'ip_address': '10.100.1.3'}], 0)
+
+    assert changed is True
+    assert len(details) == 2
+    client.api.get_request.assert_called_once_with('/load-balancer/lb-uuid/backends/main/members')
+    client.api.patch_request.assert_called_once_with('/load-balancer/lb-uuid/backends/main/members/member_0', {'weight': 0})
+
+
+def test_backend_set_weight_check_mode(client):
+    backend = LoadBalancerBackend('lb-uuid', 'main', client=client)
+    backend.read()
+
+    changed, dummy = backend.set_weight([{'ip_address': '10.100.1.4'}], 0, check_mode=True)
+
+    assert changed is True
+    client.api.patch_request.assert_not_called()
+
+
+def test_backend_unknown_member(client):
+    backend = LoadBalancerBackend('lb-uuid', 'main', client=client)
+    backend.read()
+
+    with pytest.raises(ValueError):
+        backend.set_weight([{'member_name': 'member_9'}], 0)
+
+
+def test_update_backend_members_with_list(client):
+    params = {
+        'loadbalancer_uuid': 'lb-uuid',
+        'backend_name': 'main',
+        'members': [{'member_name': 'member_1', 'ip_address': None}],
+        'weight': 0,
+    }
+
+    result = update_backend_members(params, client=client)
+
+    assert result['changed'] is False
+    assert result['loadbalancer_backend_members'][0]['name'] == 'member_1'
+
+
+def test_topology_indexes_members():
+    topology = LoadBalancerTopology([get_loadbalancer()])
+
+    assert len(topology.find()) == 4
+    assert [i['backend'] for i in topology.find(member_name='member_0')] == ['main', 'canary']
+    assert topology.find(ip_address='10.100.1.3') == [{
+        'loadbalancer': 'lb-uuid',
+        'loadbalancer_name': 'web-lb',
+        'backend': 'main',
+        'member': 'member_1',
+        'ip_address': '10.100.1.3',
+        'port': None,
+        'weight': 0,
+        'enabled': None,
+    }]
+    assert topology.find(member_name='member_0', ip_address='10.100.1.5')[0]['backend'] == 'canary'
+    assert topology.find(ip_address='10.100.1.9') == []
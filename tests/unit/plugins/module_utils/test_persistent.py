@@ -0,0 +1,76 @@
+__metaclass__ = type
+
+import os
+import threading
+import time
+
+import pytest
+
+from .....plugins.module_utils import persistent
+from .....plugins.module_utils.api import UpCloudAPI
+
+
+class RecordingAPI(UpCloudAPI):
+    def __init__(self):
+        super().__init__('Basic dGVzdDp0ZXN0', None)
+        self.requests = []
+
+    def _send(self, method, endpoint, body, params, timeout):
+        self.requests.append((method, endpoint, body))
+        if endpoint == '/missing':
+            return 404, {'error': {'error_code': 'NOT_FOUND', 'error_message': 'Not found'}}
+        return 200, {'endpoint': endpoint}
+
+
+@pytest.fixture()
+def helper(tmp_path):
+    api = RecordingAPI()
+    path = str(tmp_path / 'helper.sock')
+    ready = threading.Event()
+
+    thread = threading.Thread(target=persistent.serve, args=(api, path, 1, ready.set), daemon=True)
+    thread.start()
+    ready.wait(5)
+
+    yield api, path
+
+    thread.join(5)
+
+
+def test_requests_are_forwarded_to_helper(helper):
+    api, path = helper
+    proxy = persistent.SocketAPI(path, api)
+
+    assert proxy.ping() is True
+    assert proxy.get_request('/server') == {'endpoint': '/server'}
+    assert proxy.patch_request('/server/uuid', {'server': {}}) == {'endpoint': '/server/uuid'}
+    assert api.requests == [('GET', '/server', None), ('PATCH', '/server/uuid', {'server': {}})]
+
+
+def test_errors_are_raised_by_client(helper):
+    from upcloud_api.errors import UpCloudAPIError
+
+    api, path = helper
+    proxy = persistent.SocketAPI(path, api)
+
+    with pytest.raises(UpCloudAPIError):
+        proxy.get_request('/missing')
+
+
+def test_helper_exits_when_idle(helper):
+    api, path = helper
+
+    deadline = time.monotonic() + 5
+    while os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    assert not os.path.exists(path)
+    assert persistent.SocketAPI(path, api).ping() is False
+
+
+def test_is_enabled(monkeypatch):
+    monkeypatch.delenv(persistent.ENABLE_ENV, raising=False)
+    assert persistent.is_enabled() is False
+
+    monkeypatch.setenv(persistent.ENABLE_ENV, 'true')
+    assert persistent.is_enabled() is True
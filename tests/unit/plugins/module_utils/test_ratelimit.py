@@ -0,0 +1,49 @@
+__metaclass__ = type
+
+import pytest
+
+from .....plugins.module_utils import ratelimit
+from .....plugins.module_utils.ratelimit import RateLimiter
+
+
+class Clock:
+    """Time that advances only when sleeping"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture()
+def clock(mocker):
+    return mocker.patch.object(ratelimit, 'time', Clock())
+
+
+def test_processes_share_budget(clock, tmp_path):
+    # Limiters with the same key, as created by separate processes
+    limiters = [RateLimiter('account', rate=10, burst=2, directory=str(tmp_path)) for i in range(3)]
+
+    for i in range(6):
+        limiters[i % 3].acquire()
+
+    # Burst of two, then four more requests at ten per second
+    assert clock.now == pytest.approx(1000.4)
+
+    RateLimiter('other', rate=10, burst=2, directory=str(tmp_path)).acquire()
+    assert clock.now == pytest.approx(1000.4)
+
+
+def test_backoff_pauses_all_processes(clock, tmp_path):
+    throttled = RateLimiter('account', rate=0, directory=str(tmp_path))
+    other = RateLimiter('account', rate=0, directory=str(tmp_path))
+
+    assert other.acquire() == 0
+    throttled.backoff(3)
+
+    assert other.acquire() == pytest.approx(3)
+    assert other.acquire() == 0
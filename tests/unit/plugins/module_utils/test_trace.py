@@ -0,0 +1,46 @@
+__metaclass__ = type
+
+import json
+
+import pytest
+
+from .....plugins.module_utils import trace
+
+
+@pytest.fixture(autouse=True)
+def stop_tracing():
+    yield
+    trace.stop()
+
+
+def test_spans_are_not_recorded_without_tracer():
+    with trace.span('GET /server', 'http') as args:
+        args['status'] = 200
+
+    assert trace.active() is None
+
+
+def test_trace_is_written_in_chrome_trace_format(tmp_path):
+    tracer = trace.start()
+
+    with trace.span('parse', 'inventory'):
+        with trace.span('GET /server', 'http', endpoint='/server') as args:
+            args['status'] = 200
+
+    with pytest.raises(ValueError):
+        with trace.span('host server1', 'populate'):
+            raise ValueError('failed')
+
+    path = tmp_path / 'trace.json'
+    trace.stop().write(str(path))
+
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+
+    spans = {event['name']: event for event in events if event['ph'] == 'X'}
+    assert len(tracer.events) == 3
+    assert spans['GET /server']['args'] == {'endpoint': '/server', 'status': 200}
+    assert spans['host server1']['args'] == {'error': 'failed'}
+    assert spans['parse']['ts'] <= spans['GET /server']['ts']
+    assert spans['parse']['dur'] >= spans['GET /server']['dur']
+    assert any(event['ph'] == 'M' for event in events)
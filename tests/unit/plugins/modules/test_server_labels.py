@@ -0,0 +1,105 @@
+__metaclass__ = type
+
+import threading
+
+import pytest
+
+from .....plugins.modules.server_labels import ServerLabels
+
+
+class FakeAPI:
+    def __init__(self, servers, tags=()):
+        self.servers = servers
+        self.tags = list(tags)
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get_request(self, endpoint):
+        self.requests.append(('GET', endpoint))
+        if endpoint == '/tag':
+            return {'tags': {'tag': [{'name': tag} for tag in self.tags]}}
+        return {'servers': {'server': self.servers}}
+
+    def post_request(self, endpoint, body=None):
+        with self._lock:
+            self.requests.append(('POST', endpoint))
+        return {}
+
+    def put_request(self, endpoint, body=None):
+        with self._lock:
+            self.requests.append(('PUT', endpoint, body))
+        return {}
+
+
+def get_servers(count):
+    return [
+        {
+            'uuid': f'uuid-{i}',
+            'hostname': f'server{i}',
+            'state': 'started',
+            'zone': 'fi-hel2' if i % 2 else 'de-fra1',
+            'labels': {'label': [{'key': 'env', 'value': 'staging' if i < 3 else 'prod'}]},
+            'tags': {'tag': ['web'] if i < 2 else []},
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture()
+def client(mocker):
+    return mocker.MagicMock()
+
+
+def test_only_servers_needing_changes_are_modified(client):
+    client.api = FakeAPI(get_servers(100), tags=['web'])
+    servers = ServerLabels(filters={'labels': ['env=prod']}, client=client)
+
+    servers.plan(labels={'env': 'prod', 'release': '2'}, tags=['web'])
+    servers.apply()
+
+    puts = [r for r in client.api.requests if r[0] == 'PUT']
+    posts = [r for r in client.api.requests if r[0] == 'POST']
+    gets = [r for r in client.api.requests if r[0] == 'GET']
+    assert len(puts) == 97
+    assert len(posts) == 97
+    assert gets == [('GET', '/server'), ('GET', '/tag')]
+    assert puts[0][2] == {'server': {'labels': {'label': [{'key': 'env', 'value': 'prod'}, {'key': 'release', 'value': '2'}]}}}
+    assert all(s['changed'] and s['tags'] == ['web'] for s in servers.result())
+
+
+def test_already_labeled_servers_are_not_changed(client):
+    client.api = FakeAPI(get_servers(2))
+    servers = ServerLabels(['server0', 'uuid-1'], client=client)
+
+    assert not servers.plan(labels={'env': 'staging'}, tags=['WEB'])
+    servers.apply()
+
+    assert client.api.requests == [('GET', '/server')]
+
+
+def test_remove_and_purge(client):
+    client.api = FakeAPI(get_servers(1))
+    servers = ServerLabels(['server0'], client=client)
+
+    changes = servers.plan(labels={'role': 'db'}, purge_labels=True, remove_tags=['web'])
+
+    assert changes == {'uuid-0': ({'role': 'db'}, [], ['web'])}
+    assert servers.result()[0]['tags'] == []
+
+
+def test_missing_tags_are_created(client):
+    client.api = FakeAPI(get_servers(1))
+    servers = ServerLabels(filters={'zones': ['de-fra1']}, client=client)
+
+    servers.plan(tags=['new'])
+    servers.apply()
+
+    assert ('POST', '/tag') in client.api.requests
+    assert ('POST', '/server/uuid-0/tag/new') in client.api.requests
+
+
+def test_unknown_server(client):
+    client.api = FakeAPI(get_servers(1))
+
+    with pytest.raises(ValueError):
+        ServerLabels(['server9'], client=client)
@@ -0,0 +1,93 @@
+__metaclass__ = type
+
+import pytest
+
+from .....plugins.modules.server_state import ServerState, ServerStateTimeout
+
+
+class FakeAPI:
+    """Servers move to the requested state after the given number of listing requests."""
+
+    def __init__(self, servers, delay=1):
+        self.servers = servers
+        self.delay = delay
+        self.transitions = {}
+        self.requests = []
+
+    def get_request(self, endpoint):
+        self.requests.append(('GET', endpoint))
+        for uuid, (target, remaining) in list(self.transitions.items()):
+            server = [s for s in self.servers if s['uuid'] == uuid][0]
+            if remaining <= 0:
+                server['state'] = target
+                del self.transitions[uuid]
+            else:
+                server['state'] = 'maintenance'
+                self.transitions[uuid] = (target, remaining - 1)
+        return {'servers': {'server': [dict(s) for s in self.servers]}}
+
+    def post_request(self, endpoint, body=None):
+        self.requests.append(('POST', endpoint))
+        uuid, action = endpoint.split('/')[2:4]
+        self.transitions[uuid] = ('started' if action == 'start' else 'stopped', self.delay)
+        return {}
+
+
+def get_servers(count, state):
+    return [{'uuid': f'uuid-{i}', 'hostname': f'server{i}', 'state': state} for i in range(count)]
+
+
+@pytest.fixture()
+def client(mocker):
+    return mocker.MagicMock()
+
+
+def test_stop_polls_listing_once_per_round(client):
+    client.api = FakeAPI(get_servers(20, 'started'), delay=2)
+    servers = ServerState([f'server{i}' for i in range(20)], poll_interval=0, client=client)
+
+    servers.wait('stopped', 10)
+
+    assert all(s['state'] == 'stopped' and s['changed'] for s in servers.result())
+    posts = [r for r in client.api.requests if r[0] == 'POST']
+    gets = [r for r in client.api.requests if r[0] == 'GET']
+    assert len(posts) == 20
+    # Initial listing and three poll rounds
+    assert len(gets) == 4
+
+
+def test_already_in_state_is_not_changed(client):
+    client.api = FakeAPI(get_servers(2, 'stopped'))
+    servers = ServerState(['uuid-0', 'server1'], poll_interval=0, client=client)
+
+    servers.wait('stopped', 10)
+
+    assert not servers.changed
+    assert [r[0] for r in client.api.requests] == ['GET']
+
+
+def test_maintenance_is_requested_once_settled(client):
+    listing = get_servers(1, 'maintenance')
+    client.api = FakeAPI(listing)
+    client.api.transitions['uuid-0'] = ('stopped', 0)
+    servers = ServerState(['uuid-0'], poll_interval=0, client=client)
+
+    servers.wait('started', 10)
+
+    assert servers.result()[0]['state'] == 'started'
+    assert ('POST', '/server/uuid-0/start') in client.api.requests
+
+
+def test_unknown_server(client):
+    client.api = FakeAPI(get_servers(1, 'started'))
+
+    with pytest.raises(ValueError):
+        ServerState(['server9'], client=client)
+
+
+def test_wait_timeout(client):
+    client.api = FakeAPI(get_servers(1, 'started'), delay=100)
+    servers = ServerState(['server0'], poll_interval=0, client=client)
+
+    with pytest.raises(ServerStateTimeout):
+        servers.wait('stopped', 0)